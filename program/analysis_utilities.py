@@ -1,80 +1,354 @@
-from collections import defaultdict
 from card_utilities import *
+from deck_store import DeckStore, as_deck_store, first_appearance, COLORS, MAIN, SIDE
+from cube import as_cube
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
+import math
+import warnings
+
+OUTPUT_FORMATS = {'csv': ('csv-files', '.csv'), 'parquet': ('parquet-files', '.parquet')}
+
+class AnalysisResults(dict):
+
+    '''The result tables of an analysis run by name (e.g. 'Card_Analysis_Win%'), handed from the export functions to the
+    plots. Every table that is added is also written to the save folder as csv (the default) or parquet, or only kept
+    in memory if output_format is None.'''
+
+    def __init__(self, save_folder='results', output_format='csv'):
+        super().__init__()
+        if output_format not in OUTPUT_FORMATS and output_format is not None:
+            raise ValueError(f'Unknown output format {output_format}')
+        self.save_folder = save_folder
+        self.output_format = output_format
+
+    def add(self, name, df):
+        self[name] = df
+        if self.output_format is None:
+            return df
+
+        folder, extension = OUTPUT_FORMATS[self.output_format]
+        os.makedirs(os.path.join(self.save_folder, folder), exist_ok=True)
+        filename = os.path.join(self.save_folder, folder, name + extension)
+        if self.output_format == 'csv':
+            df.to_csv(filename, index=False)
+        else:
+            df.to_parquet(filename, index=False)
+        return df
 
-def export_card_analysis(deck_list_dict, cube_list, magic_cards, card_filter, archetype_dict, save_folder='results'):
-    
-    '''Analyzes card representation and win rates and exports them to csv. If the normalize argument is true, it normalizes 
-    card win rates to the deck win rates.'''
-    
-    card_dict = defaultdict(lambda: {'win': 0, 'loss': 0, 'num': 0, 'archetypes': [], 'main %': []})
 
-    # loop through dictionary, extract info on individual cards
-    for deck_dict in deck_list_dict.values():
+def card_occurrences(deck_list_dict, cube_list, magic_cards):
 
-        # extract deck, get its record
-        deck, side = deck_dict['main'], deck_dict['side']
-        win, loss = map(int, deck_dict['record'])
+    '''Flattens the decks (a deck dictionary or a DeckStore) into columnar arrays with one entry per card occurrence
+    (card id, deck id, and whether the card is in the main deck) and one entry per deck (wins, losses, sideboard present,
+    archetype id). Cards that are not found in magic_cards or not in the cube (a Cube or a list of card names) are left
+    out. Card ids are given in order of first appearance.'''
 
-        # get the deck archetype for normalization
-        archetypes = deck_dict['archetypes']
-        if len(archetypes) == 1: archetype = 'Pure ' + archetypes[0]
-        else: archetype = archetypes[-1]
+    store = as_deck_store(deck_list_dict)
 
-        # loop through cards in deck, check if they exist in Scryfall. If they do, store game information.
-        for card in deck:
-            
-            if not magic_cards.get(card) or (cube_list and card not in cube_list): continue
+    # check once per card name that it exists in Scryfall and in the cube, and number the valid cards in store order
+    valid = as_cube(cube_list).mask(store.card_names) & np.array([bool(magic_cards.get(card)) for card in store.card_names], dtype=bool)
+    new_ids = np.cumsum(valid) - 1
+    rows = valid[store.card_id] if len(store.card_id) else np.zeros(0, dtype=bool)
+    counts = store.card_count[rows]
 
-            else: 
-                card_dict[card]['num'] += 1
-                card_dict[card]['win'] += win
-                card_dict[card]['loss'] += loss
-                card_dict[card]['archetypes'] += [archetype]
-                
-                # if there is SB info for this deck, note that the card is in the main over the side
-                if side: card_dict[card]['main %'] += [1]
+    deck_archetypes, archetype_names = store.deck_labels() if len(store) else (np.zeros(0, dtype=np.int64), [])
 
-        # loop through sideboard if not empty, noting that the cards are in the side over main
-        for card in side:
+    return {'card_names': [card for card, is_valid in zip(store.card_names, valid) if is_valid], 'archetype_names': archetype_names,
+            'card': np.repeat(new_ids[store.card_id[rows]], counts).astype(np.int64),
+            'deck': np.repeat(store.card_deck[rows], counts).astype(np.int64),
+            'main': np.repeat(store.card_zone[rows] == MAIN, counts),
+            'deck_win': store.win.astype(np.int64), 'deck_loss': store.loss.astype(np.int64),
+            'deck_side': np.bincount(store.card_deck[store.card_zone == SIDE], minlength=len(store)) > 0,
+            'deck_archetype': deck_archetypes}
 
-            if not magic_cards.get(card) or (cube_list and card not in cube_list): continue
 
-            else: card_dict[card]['main %'] += [0]
-            
+INTERVAL_METHODS = ['none', 'beta', 'bootstrap']
 
-    print('{} unique cards identified in decklists'.format(len(card_dict)))
+def record_types(groups, wins, losses):
 
-    # extract information about the cards from scryfall dictionary
-    for card in card_dict.keys():
-        color, mana_value, card_type = magic_cards[card].values()
+    '''Groups rows of (group id, wins, losses), e.g. one row per deck of an archetype, into record types: the distinct
+    rows and how many times each occurs. Returns the group, wins, losses and count of every record type, sorted by group.'''
+
+    groups, wins, losses = (np.asarray(column, dtype=np.int64).reshape(-1) for column in (groups, wins, losses))
+    if not len(groups):
+        return groups, wins, losses, np.zeros(0, dtype=np.int64)
+
+    # pack every row into a single key, which np.unique sorts much faster than rows
+    win_range, loss_range = wins.max() + 1, losses.max() + 1
+    keys, counts = np.unique((groups * win_range + wins) * loss_range + losses, return_counts=True)
+    return keys // (win_range * loss_range), keys // loss_range % win_range, keys % loss_range, counts
+
+
+def _beta_fraction(x, a, b):
+
+    '''Continued fraction of the incomplete beta function (modified Lentz's method), for arrays of x, a and b'''
 
-        # add card characteristics
-        for characteristic, value in zip(['color', 'mana_value', 'type'], [color, mana_value, find_card_type(card_type)]):
-            card_dict[card][characteristic] = value
+    def clip(value):
+        return np.where(np.abs(value) < 1e-300, 1e-300, value)
 
-        # calculate the maindeck % rate if sideboard information exists for any of the decks that contain the card
-        if len(card_dict[card]['main %']) != 0:
-            card_dict[card]['main %'] = np.average(card_dict[card]['main %'])
+    c, d = np.ones_like(x), 1 / clip(1 - (a + b) * x / (a + 1))
+    fraction = d
+    for m in range(1, 10000):
+        even = m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m))
+        d, c = 1 / clip(1 + even * d), clip(1 + even / c)
+        fraction = fraction * d * c
+        odd = -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))
+        d, c = 1 / clip(1 + odd * d), clip(1 + odd / c)
+        fraction = fraction * d * c
+        if np.all(np.abs(d * c - 1) < 1e-12):
+            break
+    return fraction
 
-            # if the card has only ever been sideboarded, it won't contain a win %, etc so skip those analyses.
-            if card_dict[card]['main %'] == 0:
-                card_dict[card]['win %'], card_dict[card]['norm %'] = np.nan, np.nan
-                continue
 
+def beta_quantile(q, a, b):
+
+    '''The q quantiles of Beta(a, b) distributions, for arrays of q, a and b. Bisects the regularized incomplete beta
+    function, evaluated with its continued fraction on the side of the mean where that converges quickly.'''
+
+    q, a, b = np.broadcast_arrays(*(np.asarray(value, dtype=float) for value in (q, a, b)))
+    lgamma = np.frompyfunc(math.lgamma, 1, 1)
+    log_beta = (lgamma(a + b) - lgamma(a) - lgamma(b)).astype(float)
+
+    # start from 12 standard deviations around the mean, which holds every quantile used for intervals
+    mean, sd = a / (a + b), np.sqrt(a * b / ((a + b) ** 2 * (a + b + 1)))
+    low, high = np.maximum(mean - 12 * sd, 0.0), np.minimum(mean + 12 * sd, 1.0)
+    for _ in range(40):
+        x = (low + high) / 2
+        direct = x < (a + 1) / (a + b + 2)
+        first, second = np.where(direct, a, b), np.where(direct, b, a)
+        tail = np.exp(log_beta + a * np.log(x) + b * np.log1p(-x)) * _beta_fraction(np.where(direct, x, 1 - x), first, second) / first
+        below = np.where(direct, tail, 1 - tail) < q
+        low, high = np.where(below, x, low), np.where(below, high, x)
+    return (low + high) / 2
+
+
+def _interval_chunk(method, groups, wins, losses, counts, resamples, confidence, seed):
+
+    '''Interval of the win rate of every group in a chunk of record types (sorted by group)'''
+
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    alpha = (1 - confidence) / 2
+
+    if method == 'beta':
+        # the posterior of the win rate with a Jeffreys prior, from the total wins and losses of the group. As usual
+        # the interval starts at 0 without wins and ends at 1 without losses.
+        wins, losses = np.add.reduceat(wins * counts, starts), np.add.reduceat(losses * counts, starts)
+        low, high = beta_quantile([[alpha], [1 - alpha]], wins + 0.5, losses + 0.5)
+        low[wins == 0], high[losses == 0] = 0.0, 1.0
+        return groups[starts], low, high
+
+    # Poisson bootstrap over the decks: every deck is drawn Poisson(1) times, so the decks of a record type are drawn
+    # Poisson(count) times together and the cost does not grow with the number of decks. Every resample draws the win
+    # rates of all the groups at once, as a (resamples x record types) array.
+    rng = np.random.default_rng(seed)
+    draws = rng.poisson(counts, size=(resamples, len(counts)))
+    won, played = np.add.reduceat(draws * wins, starts, axis=1), np.add.reduceat(draws * (wins + losses), starts, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rates = np.where(played > 0, won / played, np.nan)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        low, high = np.nanquantile(rates, [alpha, 1 - alpha], axis=0)
+    return groups[starts], low, high
+
+
+def _mix(values):
+
+    '''Scrambles 64 bit integers (the splitmix64 finalizer)'''
+
+    values = values.astype(np.uint64)
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return values ^ (values >> np.uint64(31))
+
+
+class WinIntervals:
+
+    '''Confidence intervals for win rates. 'beta' gives the central interval of the Beta posterior of every win rate
+    (with a Jeffreys prior), 'bootstrap' resamples the decks resamples times with a Poisson bootstrap. The groups are
+    handled in chunks, spread over a pool of worker processes if workers is more than 1.
+
+    The bootstrap draws are seeded, and the intervals are computed for every distinct set of record types in an order
+    given by the records themselves, so the same decks give the same intervals whatever the order or the ids of the
+    groups.'''
+
+    def __init__(self, method='beta', resamples=2000, confidence=0.95, workers=1, seed=0, chunk_size=2_000_000):
+        if method not in INTERVAL_METHODS[1:]:
+            raise ValueError(f'Unknown interval method {method}')
+        self.method = method
+        self.resamples = resamples
+        self.confidence = confidence
+        self.workers = workers
+        self.seed = seed
+        self.chunk_size = chunk_size    # number of bootstrap draws per chunk
+
+    def __call__(self, groups, wins, losses, counts, num_groups):
+
+        '''Returns the low and high end of the interval of every group, from its record types (see record_types).
+        Groups without any games get nan.'''
+
+        low, high = np.full(num_groups, np.nan), np.full(num_groups, np.nan)
+
+        # record types without games do not change the win rate
+        played = wins + losses > 0
+        groups, wins, losses, counts = groups[played], wins[played], losses[played], counts[played]
+        if not len(groups):
+            return low, high
+
+        # groups with the same record types get the same interval, so it is computed once for each distinct set of
+        # record types (told apart by a hash), in the order of the hashes
+        starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+        lengths = np.diff(np.r_[starts, len(groups)])
+        with np.errstate(over='ignore'):
+            type_hash = _mix(_mix(_mix(wins) ^ losses.astype(np.uint64)) ^ counts.astype(np.uint64))
+            group_hash = np.add.reduceat(type_hash, starts)
+        _, first, inverse = np.unique(group_hash, return_index=True, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        keep = np.repeat(np.isin(np.arange(len(starts)), first), lengths)
+        distinct = np.repeat(inverse, lengths)[keep]
+        order = np.argsort(distinct, kind='stable')
+        group_ids, num_distinct = groups[starts], len(first)
+        groups, wins, losses, counts = distinct[order], wins[keep][order], losses[keep][order], counts[keep][order]
+
+        # split the record types into chunks of about chunk_size bootstrap draws (or one chunk per worker for the
+        # Beta intervals, which draw nothing), cut at the start of a group
+        starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+        per_chunk = max(1, self.chunk_size // self.resamples) if self.method == 'bootstrap' else -(-len(groups) // max(1, self.workers))
+        cuts = np.searchsorted(starts, np.arange(per_chunk, len(groups), per_chunk))
+        bounds = [0] + np.unique(starts[cuts[cuts < len(starts)]]).tolist() + [len(groups)]
+        seeds = np.random.SeedSequence(self.seed).spawn(len(bounds) - 1)
+        chunks = [(self.method, groups[a:b], wins[a:b], losses[a:b], counts[a:b], self.resamples, self.confidence, seed)
+                  for a, b, seed in zip(bounds[:-1], bounds[1:], seeds)]
+
+        workers = min(self.workers, len(chunks))
+        if workers <= 1:
+            chunk_results = [_interval_chunk(*chunk) for chunk in chunks]
         else:
-            card_dict[card]['main %'] = np.nan
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                chunk_results = list(executor.map(_interval_chunk, *zip(*chunks)))
+
+        distinct_low, distinct_high = np.empty(num_distinct), np.empty(num_distinct)
+        for chunk_groups, chunk_low, chunk_high in chunk_results:
+            distinct_low[chunk_groups], distinct_high[chunk_groups] = chunk_low, chunk_high
+        low[group_ids], high[group_ids] = distinct_low[inverse], distinct_high[inverse]
+        return low, high
+
+
+def record_table(decks, labels, names, store, label_column, intervals=None):
+
+    '''Counts the decks, wins and losses of every label, given as rows of (deck index, label id). Returns the table in
+    the columns of the player and archetype analyses, with the win rate intervals if intervals is given.'''
+
+    deck_win, deck_loss = store.win.astype(np.int64)[decks], store.loss.astype(np.int64)[decks]
+    num = np.bincount(labels, minlength=len(names))
+    win = np.bincount(labels, deck_win, minlength=len(names)).astype(np.int64)
+    loss = np.bincount(labels, deck_loss, minlength=len(names)).astype(np.int64)
+    interval = intervals(*record_types(labels, deck_win, deck_loss), len(names)) if intervals else None
+    return record_frame(names, num, win, loss, label_column, interval)
+
 
-        # get win rates and perform normalization by archetype win rate
-        card_dict[card]['win %'] = card_dict[card]['win']/(card_dict[card]['win'] + card_dict[card]['loss'])
-        archetype_winrates = [archetype_dict[archetype]['Win %'] for archetype in card_dict[card]['archetypes']]
-        card_dict[card]['norm %'] = card_dict[card]['win %']/np.average(archetype_winrates)
+def record_frame(names, num, win, loss, label_column, interval=None):
+
+    '''The player or archetype table from the deck, win and loss counts of every name, and the (low, high) win rate
+    interval of every name if given'''
+
+    num, win, loss = (np.asarray(column, dtype=np.int64) for column in (num, win, loss))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        win_rate = win / (win + loss)
+
+    df = pd.DataFrame({label_column: list(names), 'Num': num, 'Win': win, 'Loss': loss, 'Win %': win_rate})
+    if interval is not None:
+        df['Win % Low'], df['Win % High'] = interval
+    return df
+
+
+def card_statistics(occurrences, archetype_dict, intervals=None):
+
+    '''Computes the per card statistics (Win, Loss, Num, Main %, Win %, Norm %) from card occurrence arrays with
+    grouped sums over the card ids. If intervals is given, the Win % and Norm % intervals are added as well.'''
+
+    num_cards = len(occurrences['card_names'])
+    card, deck, main = occurrences['card'], occurrences['deck'], occurrences['main']
+    main_cards, main_decks = card[main], deck[main]
+
+    def count(ids, weights=None):
+        return np.bincount(ids, weights, minlength=num_cards)
+
+    num = count(main_cards)
+    win = count(main_cards, occurrences['deck_win'][main_decks]).astype(np.int64)
+    loss = count(main_cards, occurrences['deck_loss'][main_decks]).astype(np.int64)
+
+    # the maindeck % rate only counts decks with sideboard information
+    main_with_side = count(main_cards[occurrences['deck_side'][main_decks]])
+    in_side = count(card[~main])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        main_rate = np.where(main_with_side + in_side > 0, main_with_side / (main_with_side + in_side), np.nan)
+        win_rate = win / (win + loss)
+
+    # average archetype win rate over the main deck occurrences of each card. Occurrences are grouped by card (keeping
+    # deck order) so every mean is taken over the same values, in the same order, as a per card loop would.
+    archetype_winrates = np.array([archetype_dict[archetype]['Win %'] for archetype in occurrences['archetype_names']])
+    order = np.argsort(main_cards, kind='stable')
+    values = archetype_winrates[occurrences['deck_archetype'][main_decks[order]]]
+    bounds = np.cumsum(num)[:-1]
+    archetype_average = np.array([segment.mean() if len(segment) else np.nan for segment in np.split(values, bounds)]) if num_cards else np.zeros(0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        norm_rate = win_rate / archetype_average
+
+    # if the card has only ever been sideboarded, it won't contain a win %, etc
+    sideboarded = main_rate == 0
+    win_rate[sideboarded], norm_rate[sideboarded] = np.nan, np.nan
+
+    statistics = {'Win': win, 'Loss': loss, 'Num': num, 'Main %': main_rate, 'Win %': win_rate, 'Norm %': norm_rate}
+    if intervals:
+        # every deck counts once per card with the record times the number of copies, as in the Win and Loss totals
+        num_decks = len(occurrences['deck_win'])
+        pairs, copies = np.unique(main_cards * num_decks + main_decks, return_counts=True)
+        pair_cards, pair_decks = pairs // num_decks, pairs % num_decks
+        low, high = intervals(*record_types(pair_cards, copies * occurrences['deck_win'][pair_decks],
+                                            copies * occurrences['deck_loss'][pair_decks]), num_cards)
+        low[sideboarded], high[sideboarded] = np.nan, np.nan
+        statistics.update({'Win % Low': low, 'Win % High': high, 'Norm % Low': low / archetype_average, 'Norm % High': high / archetype_average})
+
+    return statistics
+
+
+def export_card_analysis(deck_list_dict, cube_list, magic_cards, card_filter, archetype_dict, save_folder='results', results=None, intervals=None):
+    
+    '''Analyzes card representation and win rates and exports them to csv. If the normalize argument is true, it normalizes 
+    card win rates to the deck win rates. Returns the results, with the tables sorted by Win %, Norm % and Main %. The
+    win rate intervals are added if intervals (a WinIntervals) is given.'''
 
-    # store the results of the card analysis in a dataframe. Then calculate win %, apply filter, and export to csv.
-    results = {card: {key: card_dict[card][key] for key in ['win', 'loss', 'num', 'color', 'mana_value', 'type', 'main %', 'win %', 'norm %']} for card in card_dict.keys()}
-    results_df = pd.DataFrame.from_dict(results, orient = 'index').reset_index()
-    results_df.columns = ['Name','Win', 'Loss','Num','Color', 'Mana Value', 'Type', 'Main %', 'Win %', 'Norm %']
+    results = AnalysisResults(save_folder) if results is None else results
+
+    occurrences = card_occurrences(deck_list_dict, cube_list, magic_cards)
+    statistics = card_statistics(occurrences, archetype_dict, intervals)
+    card_names = occurrences['card_names']
+
+    print('{} unique cards identified in decklists'.format(len(card_names)))
+
+    return add_card_tables(card_frame(card_names, statistics, magic_cards), card_filter, results)
+
+
+def card_frame(card_names, statistics, magic_cards):
+
+    '''The card analysis table from the per card statistics, with the color, mana value and type of every card, and the
+    win rate intervals if they are in the statistics'''
+
+    # extract information about the cards from scryfall dictionary
+    colors, mana_values, card_types = zip(*[magic_cards[card].values() for card in card_names]) if card_names else ([], [], [])
+
+    return pd.DataFrame({'Name': card_names, 'Win': statistics['Win'], 'Loss': statistics['Loss'], 'Num': statistics['Num'],
+                         'Color': list(colors), 'Mana Value': list(mana_values), 'Type': [find_card_type(card_type) for card_type in card_types],
+                         'Main %': statistics['Main %'], 'Win %': statistics['Win %'], 'Norm %': statistics['Norm %'],
+                         **{column: statistics[column] for column in INTERVAL_COLUMNS if column in statistics}})
+
+
+def add_card_tables(results_df, card_filter, results):
+
+    '''Applies the card filter to the card analysis table and adds it to the results sorted by Win %, Norm % and Main %'''
 
     if card_filter:
         results_df = results_df.loc[results_df['Num'] > card_filter]
@@ -84,182 +358,191 @@ def export_card_analysis(deck_list_dict, cube_list, magic_cards, card_filter, ar
     norm_df = results_df.sort_values(by = 'Norm %', ascending = False)
     main_df = results_df.sort_values(by = 'Main %', ascending = False)
 
-    os.makedirs(os.path.join(save_folder, 'csv-files'), exist_ok=True)
-    win_df.to_csv(os.path.join(save_folder, 'csv-files/Card_Analysis_Win%.csv'), index = False)
-    norm_df.to_csv(os.path.join(save_folder, 'csv-files/Card_Analysis_Norm%.csv'), index = False)
-    main_df.to_csv(os.path.join(save_folder, 'csv-files/Card_Analysis_Main%.csv'), index = False)
+    results.add('Card_Analysis_Win%', win_df)
+    results.add('Card_Analysis_Norm%', norm_df)
+    results.add('Card_Analysis_Main%', main_df)
 
+    return results
 
-def export_player_analysis(deck_list_dict, save_folder='results'):
-    
-    '''Analyzes player distribution and exports to csv. Will analyze by subtypes as well.'''
+
+def export_player_analysis(deck_list_dict, save_folder='results', results=None, intervals=None):
     
-    player_dict = defaultdict(lambda: {'num':0, 'win': 0, 'loss': 0})
+    '''Analyzes player distribution and exports to csv. Will analyze by subtypes as well. Returns the results.'''
+
+    results = AnalysisResults(save_folder) if results is None else results
+    store = as_deck_store(deck_list_dict)
 
-    players = []
+    # count each player of each deck, with the players in order of first appearance
+    labels, unique = first_appearance(store.player_id)
+    player_df = record_table(store.player_deck, labels, [store.player_names[player] for player in unique.tolist()], store, 'Player', intervals)
 
-    # loop through each deck, and store player information
-    for deck_dict in deck_list_dict.values():
-        
-        wins, losses = map(int, deck_dict['record'])
+    results.add('Player_Analysis', player_df)
 
-        players.extend(deck_dict['player'])    
-        
-        for player in deck_dict['player']:
-            player_dict[player]['num'] += 1
-            player_dict[player]['win'] += wins
-            player_dict[player]['loss'] += losses
+    return results
 
-    # calculate win rates for each player
-    for player in player_dict:
-        player_dict[player]['Win %'] = player_dict[player]['win']/(player_dict[player]['win'] + player_dict[player]['loss'])
+
+def export_archetype_analysis(deck_list_dict, save_folder='results', results=None, intervals=None):
     
-    # convert player analysis to dataframe, calculate winrates, then export.
-    player_df = pd.DataFrame.from_dict(player_dict, orient = 'index').reset_index()
-    player_df.columns = ['Player','Num','Win', 'Loss', 'Win %']
+    '''Analyzes archetype distribution and exports to csv. Will analyze by subtypes as well. Returns the archetype
+    dictionary used to normalize the card win rates; the table is added to the results.'''
 
-    os.makedirs(os.path.join(save_folder, 'csv-files'), exist_ok=True)
-    player_df.to_csv(os.path.join(save_folder, 'csv-files/Player_Analysis.csv'), index=False)
+    results = AnalysisResults(save_folder) if results is None else results
+    store = as_deck_store(deck_list_dict)
 
+    # count every archetype of each deck, and decks with a single archetype once more as 'Pure <archetype>'
+    decks, labels, names = store.archetype_rows()
+    archetype_df = record_table(decks, labels, names, store, 'Archetype', intervals)
 
-def export_archetype_analysis(deck_list_dict, save_folder='results'):
-    
-    '''Analyzes archetype distribution and exports to csv. Will analyze by subtypes as well.'''
-    
-    archetype_dict = defaultdict(lambda: {'num':0, 'win': 0, 'loss': 0})
+    results.add('Archetype_Analysis', archetype_df)
 
-    archetypes = []
+    archetype_dict = {row['Archetype']: {'num': row['Num'], 'win': row['Win'], 'loss': row['Loss'], 'Win %': row['Win %']}
+                      for row in archetype_df.to_dict('records')}
 
-    # loop through each deck, and store archetype information
-    for deck_dict in deck_list_dict.values():
-        
-        wins, losses = map(int, deck_dict['record'])
+    return archetype_dict
 
-        archetypes.extend(deck_dict['archetypes'])    
-        
-        if len(deck_dict['archetypes']) == 1:
-            archetype = deck_dict['archetypes'][0]
-            archetype_dict['Pure ' + archetype]['num'] += 1
-            archetype_dict['Pure ' + archetype]['win'] += wins
-            archetype_dict['Pure ' + archetype]['loss'] += losses
 
-        for archetype in deck_dict['archetypes']:
+def deck_color_counts(deck_list_dict, magic_cards):
 
-            archetype_dict[archetype]['num'] += 1
-            archetype_dict[archetype]['win'] += wins
-            archetype_dict[archetype]['loss'] += losses
+    '''Counts the nonland main deck cards of every deck by color, in one pass over the deck cards. Returns a decks x 5
+    matrix of card counts (in the order of COLORS; a multicolored card counts for each of its colors) and the number of
+    nonland cards of every deck.'''
 
-    # calculate win rates for each archetype
-    for archetype in archetype_dict:
-        archetype_dict[archetype]['Win %'] = archetype_dict[archetype]['win']/(archetype_dict[archetype]['win'] + archetype_dict[archetype]['loss'])
+    store = as_deck_store(deck_list_dict)
+    num_decks = len(store)
 
-    # convert archetype analysis to dataframe, calculate winrates, then export.
-    archetype_df = pd.DataFrame.from_dict(archetype_dict, orient = 'index').reset_index()
-    archetype_df.columns = ['Archetype','Num','Win', 'Loss', 'Win %']
+    # type and color mask of every card in the store, looked up once per card
+    table = card_table(magic_cards)
+    card_ids = [table.get_id(card) for card in store.card_names]
+    nonland = np.array([card_id is not None and table.types[card_id] != LAND for card_id in card_ids], dtype=bool)
+    masks = np.array([table.colors[card_id] if card_id is not None else 0 for card_id in card_ids], dtype=np.int64)
 
-    os.makedirs(os.path.join(save_folder, 'csv-files'), exist_ok=True)
-    archetype_df.to_csv(os.path.join(save_folder, 'csv-files/Archetype_Analysis.csv'), index=False)
+    rows = (store.card_zone == MAIN) & nonland[store.card_id] if len(store.card_id) else np.zeros(0, dtype=bool)
+    decks, cards, counts = store.card_deck[rows], store.card_id[rows], store.card_count[rows].astype(np.int64)
 
-    return archetype_dict
+    num_nonlands = np.bincount(decks, counts, minlength=num_decks).astype(np.int64)
+    color_counts = np.zeros([num_decks, len(COLORS)], dtype=np.int64)
+    for j, symbol in enumerate('WUBRG'):
+        in_color = (masks[cards] & COLOR_BITS[symbol]) != 0
+        color_counts[:, j] = np.bincount(decks[in_color], counts[in_color], minlength=num_decks)
+
+    return color_counts, num_nonlands
+
+
+def classify_colors(color_counts, num_nonlands, splash_threshold=SPLASH_THRESHOLD):
+
+    '''Splits the color counts of every deck into main colors and splashes: a color played in less than
+    splash_threshold of the nonland cards of a deck is a splash. Returns the main and splash color counts, each with
+    zeros for the colors of the other.'''
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        share = color_counts / num_nonlands[:, None]
+    splash = (color_counts != 0) & (share < splash_threshold)
+    return np.where(splash, 0, color_counts), np.where(splash, color_counts, 0)
+
+
+def export_color_analysis(deck_dict, magic_cards, save_folder='results', results=None, splash_threshold=SPLASH_THRESHOLD):
+
+    '''Analyzes how often each color is played and splashed, and exports it to csv. Returns the results.'''
 
+    results = AnalysisResults(save_folder) if results is None else results
+    color_counts, num_nonlands = deck_color_counts(deck_dict, magic_cards)
+    main, splash = classify_colors(color_counts, num_nonlands, splash_threshold)
+    num_decks = len(color_counts)
 
-def export_color_analysis(deck_dict, magic_cards, save_folder='results'):
+    has_color, has_splash = main != 0, splash != 0
+    card_spreads = [np.average(main[has_color[:, j], j] / num_nonlands[has_color[:, j]]) if has_color[:, j].any() else np.nan for j in range(len(COLORS))]
 
-    num_decks = len(deck_dict)
-    num_decks_w_color = {}
-    num_decks_w_splash = {}
-    avg_card_count = {}
+    results.add('Color_Analysis', color_frame(num_decks, has_color.sum(axis=0), has_splash.sum(axis=0), card_spreads))
 
-    for deck in deck_dict.values():
+    return results
 
-        num_nonlands = len([card for card in deck['main'] if find_card_type(magic_cards[card]['type']) != 'Land'])
 
-        for color in deck['color'].keys():
-            if deck['color'][color] != 0:
-                if color in num_decks_w_color:
-                    num_decks_w_color[color] += 1
-                else:
-                    num_decks_w_color[color] = 1
-                if color in avg_card_count:
-                    avg_card_count[color].append(deck['color'][color] / num_nonlands)
-                else:
-                    avg_card_count[color] = [deck['color'][color] / num_nonlands]
+def color_frame(num_decks, num_decks_w_color, num_decks_w_splash, card_spreads):
 
-        for color in deck['splash'].keys():
-            if deck['splash'][color] != 0:
-                if color in num_decks_w_splash:
-                    num_decks_w_splash[color] += 1
-                else:
-                    num_decks_w_splash[color] = 1
+    '''The color analysis table from the number of decks playing and splashing each color and the average share of the
+    nonland cards of each color in the decks playing it'''
 
     color_dict = {}
-    for color in deck['color'].keys():
-        deck_spread = num_decks_w_color[color] / num_decks
-        splash_spread = num_decks_w_splash[color] / (num_decks - num_decks_w_splash[color])
-        card_spread = np.average(avg_card_count[color])
-        color_dict[color] = {'Deck %': deck_spread, 'Splash %': splash_spread, 'Avg Card %': card_spread}
+    for j, color in enumerate(COLORS):
+        # colors that are never played (or never splashed) get 0, and no average card share
+        deck_spread = num_decks_w_color[j] / num_decks if num_decks else 0.0
+        splash_spread = num_decks_w_splash[j] / (num_decks - num_decks_w_splash[j]) if num_decks > num_decks_w_splash[j] else 0.0
+        color_dict[color] = {'Deck %': deck_spread, 'Splash %': splash_spread, 'Avg Card %': card_spreads[j]}
 
     color_df = pd.DataFrame.from_dict(color_dict, orient = 'index').reset_index()
     color_df.columns = ['Color', 'Deck %', 'Splash %', 'Avg Card %']
+    return color_df
+
+
+def export_color_curve(deck_dict, magic_cards=None, splash_threshold=SPLASH_THRESHOLD):
+
+    '''Returns the share of decks by number of main colors, with and without a splash. The colors are counted from the
+    cards if magic_cards is given, and otherwise taken from the colors found when the decks were parsed. Decks without a
+    main color are counted as Colorless.'''
+
+    store = as_deck_store(deck_dict)
+    if magic_cards is not None:
+        main, splash = classify_colors(*deck_color_counts(store, magic_cards), splash_threshold)
+    else:
+        main, splash = store.color, store.splash
+
+    # bucket index of every deck, as in color_bucket
+    colors, splashed = (main != 0).sum(axis=1), (splash != 0).any(axis=1)
+    buckets = np.where(colors == 0, 0, np.minimum(2 * colors + splashed - 1, len(COLOR_BUCKETS) - 1))
+    counts = np.bincount(buckets, minlength=len(COLOR_BUCKETS))
+
+    return color_curve(dict(zip(COLOR_BUCKETS, counts.tolist())), len(store))
+
+
+COLOR_BUCKETS = ['Colorless', 'One', 'One + Splash', 'Two', 'Two + Splash', 'Three', 'Three + Splash', 'Four', 'Four + Splash', 'Five']
+
+def color_bucket(colors, splashed):
 
-    os.makedirs(os.path.join(save_folder, 'csv-files'), exist_ok=True)
-    color_df.to_csv(os.path.join(save_folder, 'csv-files/Color_Analysis.csv'), index=False)
+    '''The color curve bucket of a deck with the given number of main colors, with or without a splash'''
 
+    return COLOR_BUCKETS[0] if colors == 0 else COLOR_BUCKETS[min(2 * colors + splashed - 1, len(COLOR_BUCKETS) - 1)]
 
-def export_color_curve(deck_dict):
-    num_colors = {'One': 0, 'One + Splash': 0,
-                  'Two': 0, 'Two + Splash': 0,
-                  'Three': 0, 'Three + Splash': 0,
-                  'Four': 0, 'Four + Splash': 0,
-                  'Five': 0}
 
-    for deck in deck_dict.values():
-        splash = False
-        colors = 0
-        for color in deck['color'].keys():
-            if deck['color'][color] != 0:
-                colors += 1
-        for color in deck['splash'].keys():
-            if deck['splash'][color] != 0:
-                splash = True
-        
-        num_colors[list(num_colors.keys())[2 * colors + splash - 2]] += 1
+def color_curve(counts, num_decks):
 
-    num_decks = len(deck_dict)
-    for colors in list(num_colors.keys()):
-        num_colors[colors] /= num_decks
+    '''The share of decks in every color curve bucket from the number of decks in each. Colorless is only listed if
+    there are colorless decks.'''
 
-    return num_colors
+    return {bucket: counts.get(bucket, 0) / num_decks for bucket in COLOR_BUCKETS if bucket != 'Colorless' or counts.get(bucket)}
 
 def export_timecourse_analysis(deck_dict, window):
     '''If specified, analyze the decklists and the archetype win rates over time. Returns a dataframe that is then plotted.'''
 
     # Extract all the archetypes present in the decklists, and the corresponding dates
-    decklists = deck_dict.values()
-    archetypes = [deck['archetypes'] for deck in decklists]
-    archetypes = list(set([archetype for archetype_list in archetypes for archetype in archetype_list]))
-    dates = [int(deck['date']) for deck in decklists]
-
-    # Sort the decklists based on the date they were added.
-    sorted_decklists = [deck for _, deck in sorted(zip(dates, decklists))]
-    window_num = len(sorted_decklists) - window + 1
-    storage_matrix = np.zeros([len(archetypes), window_num])
-
-    # Conduct a sliding window analysis, storing the average win rate for the archetypes during this window.
-    for i in range(window_num):
-        decklist_window = sorted_decklists[i:i + window]
-        for j, archetype in enumerate(archetypes):
-            records = np.array([deck['record'] for deck in decklist_window if archetype in deck['archetypes']])
-            
-            # Handle empty records
-            if len(records) == 0:
-                storage_matrix[j, i] = np.nan  # Use NaN for missing data
-            else:
-                total_wins = np.sum(records[:, 0])  # Sum of wins
-                total_games = np.sum(records)       # Sum of wins + losses
-                if total_games > 0:
-                    storage_matrix[j, i] = total_wins / total_games
-                else:
-                    storage_matrix[j, i] = np.nan  # Avoid division by zero
-
-    return archetypes, storage_matrix
\ No newline at end of file
+    store = as_deck_store(deck_dict)
+    archetypes = list(set(store.archetype_names))
+    dates = store.dates.astype(np.int64)
+
+    # Sort the decks based on the date they were added.
+    order = np.argsort(dates, kind='stable')
+    position = np.empty(len(order), dtype=np.int64)
+    position[order] = np.arange(len(order))
+    num_decks = len(store)
+    window_num = max(num_decks - window + 1, 0)
+
+    # Per archetype wins, games and deck counts of every deck, in date order
+    archetype_index = np.array([archetypes.index(archetype) for archetype in store.archetype_names], dtype=np.int64)
+    membership = np.zeros([len(archetypes), num_decks], dtype=np.int64)
+    membership[archetype_index[store.archetype_id], position[store.archetype_deck]] = 1
+    records = np.stack([store.win, store.loss], axis=1)[order]
+
+    # Conduct a sliding window analysis from prefix sums: the total of a window is the difference of two prefix sums.
+    def window_sums(values):
+        prefix_sums = np.zeros([len(archetypes), num_decks + 1], dtype=values.dtype)
+        np.cumsum(values, axis=1, out=prefix_sums[:, 1:])
+        return prefix_sums[:, window:window + window_num] - prefix_sums[:, :window_num]
+
+    decks = window_sums(membership)
+    total_wins = window_sums(membership * records[:, 0])       # Sum of wins
+    total_games = window_sums(membership * records.sum(axis=1)) # Sum of wins + losses
+
+    # Use NaN for windows without the archetype, and avoid division by zero
+    with np.errstate(divide='ignore', invalid='ignore'):
+        storage_matrix = np.where((decks > 0) & (total_games > 0), total_wins / total_games, np.nan)
+
+    return archetypes, storage_matrix
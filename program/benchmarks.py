@@ -0,0 +1,655 @@
+'''Benchmarks for the slow stages of the analysis. Run from the CubeAnalyser folder, e.g.
+
+    python program/benchmarks.py card-store --cards program/magic_cards.json --cube cube_list.txt
+'''
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def timed(function, *args, repeat=3, **kwargs):
+
+    '''Returns the best wall time (in seconds) of repeated calls to function, and the result of the last call'''
+
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def report(name, seconds, baseline=None):
+    speedup = f' ({baseline / seconds:.1f}x)' if baseline else ''
+    print(f'{name:<45}{seconds * 1000:>10.1f} ms{speedup}')
+
+
+def bench_card_store(args):
+
+    '''Startup cost of loading magic_cards.json versus opening the binary card store, including the cube lookups'''
+
+    from card_store import build_card_store, CardStore
+
+    with open(args.cards, 'r', encoding='utf-8') as file:
+        cards = json.load(file)
+
+    if args.cube:
+        with open(args.cube) as cube_file:
+            names = [line.strip() for line in cube_file]
+    else:
+        names = list(cards)[::max(1, len(cards) // 540)]
+
+    def load_json():
+        with open(args.cards, 'r', encoding='utf-8') as file:
+            magic_cards = json.load(file)
+        return [magic_cards.get(name) for name in names]
+
+    with tempfile.TemporaryDirectory() as folder:
+        store_file = os.path.join(folder, 'magic_cards.bin')
+        build_time, _ = timed(build_card_store, cards, store_file, repeat=1)
+
+        def load_store():
+            magic_cards = CardStore(store_file)
+            return [magic_cards.get(name) for name in names]
+
+        print(f'{len(cards)} cards, {len(names)} lookups')
+        print(f'JSON size {os.path.getsize(args.cards) / 1e6:.1f} MB, store size {os.path.getsize(store_file) / 1e6:.1f} MB')
+        json_time, json_result = timed(load_json)
+        store_time, store_result = timed(load_store)
+        assert json_result == store_result
+
+    report('build store (one-off)', build_time)
+    report('json.load + lookups', json_time)
+    report('card store + lookups', store_time, json_time)
+
+
+def make_deck_folder(source, folder, num_decks):
+
+    '''Fills folder with num_decks deck files, cycling through the deck files in source'''
+
+    deck_files = sorted(f for f in os.listdir(source) if f.endswith('.txt'))
+    for i in range(num_decks):
+        deck_file = deck_files[i % len(deck_files)]
+        name = '_'.join(deck_file.split('_')[:-1] + [f'{i}.txt'])
+        with open(os.path.join(source, deck_file), 'rb') as infile, open(os.path.join(folder, name), 'wb') as outfile:
+            outfile.write(infile.read())
+
+
+def bench_parse(args):
+
+    '''Serial versus parallel parsing of a synthetic deck folder'''
+
+    from card_utilities import fetch_cards
+    from deck_utilities import extract_decklists
+
+    magic_cards = fetch_cards(False, args.cards)
+
+    with tempfile.TemporaryDirectory() as folder:
+        make_deck_folder(args.decks, folder, args.num_decks)
+        print(f'{args.num_decks} decks')
+
+        serial_time, serial_decks = timed(extract_decklists, folder, magic_cards, [], True, repeat=1)
+        report('serial', serial_time)
+        for workers in args.workers:
+            parallel_time, parallel_decks = timed(extract_decklists, folder, magic_cards, [], True, workers=workers, repeat=1)
+            assert list(parallel_decks.items()) == list(serial_decks.items())
+            report(f'{workers} workers', parallel_time, serial_time)
+
+
+def synthetic_decks(args):
+
+    '''Parses the decks in args.decks and repeats them up to args.num_decks decks'''
+
+    from card_utilities import fetch_cards
+    from deck_utilities import extract_decklists
+
+    magic_cards = fetch_cards(False, args.cards)
+    decks = list(extract_decklists(args.decks, magic_cards, [], True).values())
+    deck_dict = {i: dict(decks[i % len(decks)], date=str(i)) for i in range(args.num_decks)}
+    return magic_cards, deck_dict
+
+
+def card_analysis_reference(deck_dict, cube_list, magic_cards, archetype_dict):
+
+    '''The card analysis table as export_card_analysis built it before it used the deck store (a defaultdict per card and
+    np.average of the main deck flags and archetype win rates), kept as a reference. Returns the table unfiltered and
+    unsorted.'''
+
+    from collections import defaultdict
+    import numpy as np
+    import pandas as pd
+    from card_utilities import find_card_type
+
+    card_dict = defaultdict(lambda: {'win': 0, 'loss': 0, 'num': 0, 'archetypes': [], 'main %': []})
+    for deck in deck_dict.values():
+        main, side = deck['main'], deck['side']
+        win, loss = map(int, deck['record'])
+        archetypes = deck['archetypes']
+        archetype = 'Pure ' + archetypes[0] if len(archetypes) == 1 else archetypes[-1]
+
+        for card in main:
+            if not magic_cards.get(card) or (cube_list and card not in cube_list):
+                continue
+            card_dict[card]['num'] += 1
+            card_dict[card]['win'] += win
+            card_dict[card]['loss'] += loss
+            card_dict[card]['archetypes'] += [archetype]
+            if side:
+                card_dict[card]['main %'] += [1]
+        for card in side:
+            if magic_cards.get(card) and not (cube_list and card not in cube_list):
+                card_dict[card]['main %'] += [0]
+
+    for card, entry in card_dict.items():
+        color, mana_value, card_type = magic_cards[card].values()
+        entry['color'], entry['mana_value'], entry['type'] = color, mana_value, find_card_type(card_type)
+        if len(entry['main %']) != 0:
+            entry['main %'] = np.average(entry['main %'])
+            if entry['main %'] == 0:
+                entry['win %'], entry['norm %'] = np.nan, np.nan
+                continue
+        else:
+            entry['main %'] = np.nan
+        entry['win %'] = entry['win'] / (entry['win'] + entry['loss'])
+        entry['norm %'] = entry['win %'] / np.average([archetype_dict[archetype]['Win %'] for archetype in entry['archetypes']])
+
+    results = {card: {key: entry[key] for key in ['win', 'loss', 'num', 'color', 'mana_value', 'type', 'main %', 'win %', 'norm %']}
+               for card, entry in card_dict.items()}
+    results_df = pd.DataFrame.from_dict(results, orient='index').reset_index()
+    results_df.columns = ['Name', 'Win', 'Loss', 'Num', 'Color', 'Mana Value', 'Type', 'Main %', 'Win %', 'Norm %']
+    return results_df
+
+
+def bench_card_analysis(args):
+
+    '''Card analysis (Win %, Main %, Norm %) over a large synthetic deck archive, checked against the old loop: the
+    three card tables must give the same csv files'''
+
+    from analysis_utilities import AnalysisResults, add_card_tables, export_archetype_analysis, export_card_analysis
+
+    magic_cards, deck_dict = synthetic_decks(args)
+    archetype_dict = export_archetype_analysis(deck_dict, results=AnalysisResults(output_format=None))
+    cube_list = list(magic_cards)[::2]
+
+    reference_time, reference_df = timed(card_analysis_reference, deck_dict, cube_list, magic_cards, archetype_dict, repeat=1)
+    reference = add_card_tables(reference_df, args.filter, AnalysisResults(output_format=None))
+    card_time, results = timed(export_card_analysis, deck_dict, cube_list, magic_cards, args.filter, archetype_dict,
+                               results=AnalysisResults(output_format=None), repeat=1)
+
+    print(f'{len(deck_dict)} decks')
+    report('old loop', reference_time)
+    report('export_card_analysis', card_time, reference_time)
+    for name in ['Card_Analysis_Win%', 'Card_Analysis_Norm%', 'Card_Analysis_Main%']:
+        assert results[name].to_csv(index=False) == reference[name].to_csv(index=False), f'{name} differs from the old loop'
+    print('card tables match the old loop')
+
+
+def timecourse_reference(deck_dict, window):
+
+    '''The sliding window loop export_timecourse_analysis used before it switched to prefix sums, kept as a reference'''
+
+    import numpy as np
+
+    decklists = deck_dict.values()
+    archetypes = [deck['archetypes'] for deck in decklists]
+    archetypes = list(set([archetype for archetype_list in archetypes for archetype in archetype_list]))
+    dates = [int(deck['date']) for deck in decklists]
+
+    sorted_decklists = [deck for _, deck in sorted(zip(dates, decklists), key=lambda pair: pair[0])]
+    window_num = len(sorted_decklists) - window + 1
+    storage_matrix = np.zeros([len(archetypes), window_num])
+
+    for i in range(window_num):
+        decklist_window = sorted_decklists[i:i + window]
+        for j, archetype in enumerate(archetypes):
+            records = np.array([deck['record'] for deck in decklist_window if archetype in deck['archetypes']])
+            if len(records) == 0:
+                storage_matrix[j, i] = np.nan
+            else:
+                total_wins = np.sum(records[:, 0])
+                total_games = np.sum(records)
+                storage_matrix[j, i] = total_wins / total_games if total_games > 0 else np.nan
+
+    return archetypes, storage_matrix
+
+
+def bench_timecourse(args):
+
+    '''Sliding window archetype win rates, checked against the reference loop'''
+
+    import numpy as np
+    from analysis_utilities import export_timecourse_analysis
+
+    _, deck_dict = synthetic_decks(args)
+    print(f'{len(deck_dict)} decks, window {args.window}')
+
+    reference_time, (reference_archetypes, reference) = timed(timecourse_reference, deck_dict, args.window, repeat=1)
+    new_time, (archetypes, storage_matrix) = timed(export_timecourse_analysis, deck_dict, args.window)
+
+    order = [archetypes.index(archetype) for archetype in reference_archetypes]
+    assert np.array_equal(storage_matrix[order], reference, equal_nan=True), 'timecourse differs from the reference'
+
+    report('reference loop', reference_time)
+    report('prefix sums', new_time, reference_time)
+
+
+def pyplot_reference(plots):
+
+    '''Renders plots serially through pyplot, as visuals did before it drew on Agg figures directly: every figure is
+    made by pyplot (with its figure manager and global state) and closed after saving. Kept as a reference.'''
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import visuals
+
+    new_figure, save_figure = visuals.new_figure, visuals.save_figure
+
+    def save_and_close(fig, *args, **kwargs):
+        save_figure(fig, *args, **kwargs)
+        plt.close(fig)
+
+    visuals.new_figure, visuals.save_figure = lambda figsize=None: plt.figure(figsize=figsize), save_and_close
+    try:
+        visuals.render_plots(plots)
+    finally:
+        visuals.new_figure, visuals.save_figure = new_figure, save_figure
+
+
+def bench_plots(args):
+
+    '''Total plotting time of the old pyplot path (serial, 300 dpi png) versus the Agg figures, parallel workers, lower
+    dpi and other formats'''
+
+    from analysis_utilities import (AnalysisResults, export_archetype_analysis, export_card_analysis, export_color_analysis,
+                                    export_player_analysis, export_timecourse_analysis, export_color_curve)
+    from visuals import (render_plots, plot_timecourse, plot_color_curve, plot_archetype_analysis, plot_card_win_analysis,
+                         plot_card_main_analysis, plot_card_norm_analysis, plot_color_analysis, plot_player_analysis)
+
+    magic_cards, deck_dict = synthetic_decks(args)
+    results = AnalysisResults(output_format=None)
+    archetype_dict = export_archetype_analysis(deck_dict, results=results)
+    export_card_analysis(deck_dict, list(magic_cards), magic_cards, 0, archetype_dict, results=results)
+    export_color_analysis(deck_dict, magic_cards, results=results)
+    export_player_analysis(deck_dict, results=results)
+    archetypes, timecourse = export_timecourse_analysis(deck_dict, 100)
+    color_curve = export_color_curve(deck_dict)
+
+    def plots(folder, **image_settings):
+        return [('time trend', plot_timecourse, (archetypes, timecourse, 100, folder), image_settings),
+                ('color curve', plot_color_curve, (color_curve, folder), image_settings)] + \
+               [(name, function, (folder, results[name]), image_settings) for name, function in
+                [('Archetype_Analysis', plot_archetype_analysis), ('Card_Analysis_Win%', plot_card_win_analysis),
+                 ('Card_Analysis_Main%', plot_card_main_analysis), ('Card_Analysis_Norm%', plot_card_norm_analysis),
+                 ('Color_Analysis', plot_color_analysis), ('Player_Analysis', plot_player_analysis)]]
+
+    print(f'{len(deck_dict)} decks, {len(plots(None))} plots')
+    with tempfile.TemporaryDirectory() as folder:
+        reference_time, _ = timed(pyplot_reference, plots(folder), repeat=args.repeat)
+        report('pyplot, serial, 300 dpi png', reference_time)
+        serial_time, _ = timed(render_plots, plots(folder), repeat=args.repeat)
+        report('serial, 300 dpi png', serial_time, reference_time)
+        for workers in args.workers:
+            parallel_time, _ = timed(render_plots, plots(folder), workers, repeat=args.repeat)
+            report(f'{workers} workers, 300 dpi png', parallel_time, reference_time)
+        for dpi, image_format in [(150, 'png'), (300, 'webp'), (300, 'svg')]:
+            format_time, _ = timed(render_plots, plots(folder, dpi=dpi, image_format=image_format), repeat=args.repeat)
+            report(f'serial, {dpi} dpi {image_format}', format_time, reference_time)
+
+
+def get_colors_reference(maindeck, magic_cards):
+
+    '''get_colors before it used the card table (substring tests on the card type and color per card), kept as a
+    reference'''
+
+    from card_utilities import find_card_type
+
+    deck_colors = {'White': 0, 'Blue': 0, 'Black': 0, 'Red': 0, 'Green': 0}
+    splash_colors = {'White': 0, 'Blue': 0, 'Black': 0, 'Red': 0, 'Green': 0}
+
+    for card in maindeck:
+        if find_card_type(magic_cards[card]['type']) != 'Land':
+            card_color = magic_cards[card]['color']
+            if 'W' in card_color:
+                deck_colors['White'] += 1
+            if 'U' in card_color:
+                deck_colors['Blue'] += 1
+            if 'B' in card_color:
+                deck_colors['Black'] += 1
+            if 'R' in card_color:
+                deck_colors['Red'] += 1
+            if 'G' in card_color:
+                deck_colors['Green'] += 1
+
+    num_nonlands = len([card for card in maindeck if find_card_type(magic_cards[card]['type']) != 'Land'])
+    for color in deck_colors.keys():
+        if deck_colors[color]/num_nonlands < 0.15 and deck_colors[color] != 0:
+            splash_colors[color] = deck_colors[color]
+            deck_colors[color] = 0
+
+    return deck_colors, splash_colors
+
+
+def bench_colors(args):
+
+    '''Color and splash classification of every deck, with the card table versus the reference string tests'''
+
+    from deck_utilities import get_colors
+
+    magic_cards, deck_dict = synthetic_decks(args)
+    maindecks = [deck['main'] for deck in deck_dict.values()]
+    print(f'{len(maindecks)} decks')
+
+    reference_time, reference = timed(lambda: [get_colors_reference(deck, magic_cards) for deck in maindecks], repeat=1)
+    table_time, colors = timed(lambda: [get_colors(deck, magic_cards) for deck in maindecks], repeat=1)
+    assert colors == reference, 'deck colors differ from the reference'
+
+    report('reference (string tests)', reference_time)
+    report('card table', table_time, reference_time)
+
+    # the batch engine classifies all decks at once from the deck store
+    from deck_store import DeckStore
+    from analysis_utilities import deck_color_counts, classify_colors
+
+    store = DeckStore.from_decks(deck_dict)
+    batch_time, (main, splash) = timed(lambda: classify_colors(*deck_color_counts(store, magic_cards)))
+    assert [list(deck_colors.values()) for deck_colors, _ in reference] == main.tolist()
+    assert [list(splash_colors.values()) for _, splash_colors in reference] == splash.tolist()
+    report('batch (deck store arrays)', batch_time, reference_time)
+
+
+def bench_deck_store(args):
+
+    '''Load time, memory and analysis time of the deck dictionary (loaded from JSON, like the deck cache) versus the
+    columnar deck store'''
+
+    import tracemalloc
+    from deck_store import DeckStore
+    from analysis_utilities import (AnalysisResults, export_archetype_analysis, export_card_analysis, export_color_analysis,
+                                    export_player_analysis)
+
+    magic_cards, deck_dict = synthetic_decks(args)
+
+    def load_dict(filename):
+        with open(filename, 'r', encoding='utf-8') as file:
+            return {int(key): deck for key, deck in json.load(file).items()}
+
+    def memory(function, *args):
+        tracemalloc.start()
+        result = function(*args)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return size, result
+
+    def analyses(decks):
+        results = AnalysisResults(output_format=None)
+        archetype_dict = export_archetype_analysis(decks, results=results)
+        export_card_analysis(decks, [], magic_cards, 0, archetype_dict, results=results)
+        export_color_analysis(decks, magic_cards, results=results)
+        export_player_analysis(decks, results=results)
+        return results
+
+    with tempfile.TemporaryDirectory() as folder:
+        json_file, store_file = os.path.join(folder, 'decks.json'), os.path.join(folder, 'deck_store.npz')
+        with open(json_file, 'w', encoding='utf-8') as file:
+            json.dump(deck_dict, file, ensure_ascii=False)
+        build_time, store = timed(DeckStore.from_decks, deck_dict, repeat=1)
+        store.save(store_file)
+
+        print(f'{len(deck_dict)} decks, {len(store.card_deck)} deck card rows')
+        print(f'JSON size {os.path.getsize(json_file) / 1e6:.1f} MB, store size {os.path.getsize(store_file) / 1e6:.1f} MB')
+
+        json_time, deck_dict = timed(load_dict, json_file)
+        store_time, store = timed(DeckStore.load, store_file)
+        dict_memory, _ = memory(load_dict, json_file)
+        store_memory, _ = memory(DeckStore.load, store_file)
+
+    report('build store from the dictionary (one-off)', build_time)
+    report('load deck dictionary (JSON)', json_time)
+    report('load deck store (npz)', store_time, json_time)
+    print(f'{"memory deck dictionary":<45}{dict_memory / 1e6:>10.1f} MB')
+    print(f'{"memory deck store":<45}{store_memory / 1e6:>10.1f} MB')
+
+    dict_time, dict_results = timed(analyses, deck_dict, repeat=1)
+    store_time, store_results = timed(analyses, store, repeat=1)
+    for name in dict_results:
+        assert dict_results[name].equals(store_results[name]), f'{name} differs'
+    report('analyses from the dictionary', dict_time)
+    report('analyses from the store', store_time, dict_time)
+
+
+def bench_intervals(args):
+
+    '''Win rate intervals of every card and archetype, by method and worker count. The archetype intervals are
+    checked against a plain bootstrap that resamples the decks.'''
+
+    from deck_store import DeckStore
+    import numpy as np
+    from analysis_utilities import AnalysisResults, WinIntervals, card_occurrences, card_statistics, export_archetype_analysis, record_types
+
+    magic_cards, deck_dict = synthetic_decks(args)
+    store = DeckStore.from_decks(deck_dict)
+    archetype_dict = export_archetype_analysis(store, None, AnalysisResults(output_format=None))
+    occurrences = card_occurrences(store, [], magic_cards)
+    print(f'{len(store)} decks, {len(occurrences["card_names"])} cards, {args.resamples} resamples')
+
+    base_time, _ = timed(card_statistics, occurrences, archetype_dict, repeat=1)
+    report('card statistics without intervals', base_time)
+    for method in ['beta', 'bootstrap']:
+        for workers in args.workers:
+            intervals = WinIntervals(method, args.resamples, workers=workers)
+            interval_time, _ = timed(card_statistics, occurrences, archetype_dict, intervals, repeat=1)
+            report(f'{method}, {workers} workers', interval_time)
+
+    # plain bootstrap of the archetype win rates: draw the decks with replacement and recount
+    decks, labels, names = store.archetype_rows()
+    win, loss = store.win.astype(np.int64), store.loss.astype(np.int64)
+    rng = np.random.default_rng(0)
+    rates = []
+    for _ in range(200):
+        weights = np.bincount(rng.integers(0, len(store), len(store)), minlength=len(store))[decks]
+        won = np.bincount(labels, weights * win[decks], minlength=len(names))
+        played = np.bincount(labels, weights * (win + loss)[decks], minlength=len(names))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rates.append(won / played)
+    reference_low, reference_high = np.nanquantile(rates, [0.025, 0.975], axis=0)
+    low, high = WinIntervals('bootstrap', 200)(*record_types(labels, win[decks], loss[decks]), len(names))
+    width = np.nanmedian(reference_high - reference_low)
+    assert np.nanmax(np.abs(low - reference_low)) < width / 2 and np.nanmax(np.abs(high - reference_high)) < width / 2, \
+        'bootstrap intervals differ from the plain bootstrap'
+    print('archetype intervals agree with a plain bootstrap')
+
+
+def bench_names(args):
+
+    '''Correction of misspelled card names with the name index, versus difflib over every card name. The misspellings
+    are generated from the card names (a dropped, swapped or changed letter, lower case, no accents, split cards
+    written with a single slash) and the corrections are checked against the names they came from.'''
+
+    import difflib
+    import random
+    import unicodedata
+    from card_store import open_card_store
+    from card_names import CardNameIndex, normalize_name
+
+    magic_cards = open_card_store(args.cards)
+    names = list(magic_cards)
+    rng = random.Random(0)
+
+    def misspell(name):
+        kind = rng.randrange(4)
+        i = rng.randrange(1, max(2, len(name) - 1))
+        if kind == 0:
+            return name[:i] + name[i + 1:]
+        if kind == 1:
+            return name[:i - 1] + name[i] + name[i - 1] + name[i + 1:]
+        if kind == 2:
+            return name[:i] + rng.choice('aeiourstn') + name[i + 1:]
+        name = unicodedata.normalize('NFKD', name.lower())
+        return ''.join(character for character in name if not unicodedata.combining(character)).replace(' // ', '/')
+
+    originals = [rng.choice(names) for _ in range(args.num_names)]
+    misspelled = [misspell(name) for name in originals]
+
+    build_time, index = timed(CardNameIndex.from_cards, magic_cards, repeat=1)
+    with tempfile.TemporaryDirectory() as folder:
+        index_file = os.path.join(folder, 'names.npz')
+        index.save(index_file)
+        load_time, _ = timed(CardNameIndex.load, index_file, index.fingerprint)
+
+    def correct_all():
+        fresh = CardNameIndex(index.names, index.keys, index.offsets, index.postings)
+        fresh.set_targets(index.targets)
+        return [fresh.correct(name) for name in misspelled]
+
+    print(f'{len(names)} cards, {len(misspelled)} misspelled names')
+    report('build name index (one-off)', build_time)
+    report('load name index', load_time)
+    correct_time, corrected = timed(correct_all, repeat=1)
+
+    # difflib over every normalized card name, on a sample since it is slow
+    sample = misspelled[:args.reference]
+    normalized = {normalize_name(name): name for name in names}
+    reference_time, _ = timed(lambda: [difflib.get_close_matches(normalize_name(name), normalized, 1, 0.9) for name in sample], repeat=1)
+    report(f'difflib, {len(sample)} names', reference_time)
+    report(f'name index, {len(sample)} names', correct_time * len(sample) / len(misspelled), reference_time)
+    report(f'name index, {len(misspelled)} names', correct_time)
+
+    right = sum(correction == original for correction, original in zip(corrected, originals))
+    wrong = sum(correction not in (None, original) for correction, original in zip(corrected, originals))
+    print(f'{right / len(originals):.1%} corrected, {wrong / len(originals):.2%} corrected to another card')
+    assert correct_time < 1, f'correcting {len(misspelled)} names took more than a second'
+
+
+def bench_startup(args):
+
+    '''Wall time of starting the headless command line entry point, and of importing the full pipeline'''
+
+    import subprocess
+
+    program = os.path.dirname(os.path.abspath(__file__))
+    commands = {'cli.py --help': [sys.executable, os.path.join(program, 'cli.py'), '--help'],
+                'import pipeline': [sys.executable, '-c', 'import pipeline'],
+                'python (interpreter only)': [sys.executable, '-c', 'pass']}
+
+    for name, command in commands.items():
+        seconds, _ = timed(subprocess.run, command, cwd=program, stdout=subprocess.DEVNULL, check=True, repeat=args.repeat)
+        report(name, seconds)
+
+
+def bench_imports(args):
+
+    '''Import cost of the program modules, per module, as reported by python -X importtime'''
+
+    import subprocess
+
+    program = os.path.dirname(os.path.abspath(__file__))
+    for module in args.modules:
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=program,
+                                stderr=subprocess.PIPE, text=True, check=True)
+
+        # lines look like "import time: self [us] | cumulative | imported package", nested imports are indented by two
+        # more spaces. Report the module itself and the packages it imports directly.
+        total, costs, children = 0, [], []
+        for line in result.stderr.splitlines()[1:]:
+            if not line.startswith('import time:'):
+                continue
+            _, cumulative, name = line.split(':', 1)[1].split('|')
+            if not name.startswith('  '):
+                # a top level import, listed after everything it imported
+                if name.strip() == module:
+                    total, costs = int(cumulative), children
+                children = []
+            elif not name.startswith('     '):
+                children.append((int(cumulative), name.strip()))
+
+        print(f'import {module}: {total / 1000:.1f} ms')
+        for cost, name in sorted(costs, reverse=True)[:args.top]:
+            print(f'    {name:<41}{cost / 1000:>10.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CubeAnalyser benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    card_store = subparsers.add_parser('card-store', help='magic_cards.json versus the binary card store')
+    card_store.add_argument('--cards', default='program/magic_cards.json')
+    card_store.add_argument('--cube', default=None)
+    card_store.set_defaults(run=bench_card_store)
+
+    parse = subparsers.add_parser('parse', help='serial versus parallel deck parsing')
+    parse.add_argument('--cards', default='program/magic_cards.json')
+    parse.add_argument('--decks', default='example/deck_folder', help='folder with deck files to copy from')
+    parse.add_argument('--num-decks', type=int, default=10000)
+    parse.add_argument('--workers', type=int, nargs='+', default=[2, 4, 8])
+    parse.set_defaults(run=bench_parse)
+
+    card_analysis = subparsers.add_parser('card-analysis', help='card analysis over a large deck archive')
+    card_analysis.add_argument('--cards', default='program/magic_cards.json')
+    card_analysis.add_argument('--decks', default='example/deck_folder', help='folder with deck files to repeat')
+    card_analysis.add_argument('--num-decks', type=int, default=100000)
+    card_analysis.add_argument('--filter', type=int, default=5)
+    card_analysis.set_defaults(run=bench_card_analysis)
+
+    timecourse = subparsers.add_parser('timecourse', help='sliding window win rates, checked against the old loop')
+    timecourse.add_argument('--cards', default='program/magic_cards.json')
+    timecourse.add_argument('--decks', default='example/deck_folder', help='folder with deck files to repeat')
+    timecourse.add_argument('--num-decks', type=int, default=5000)
+    timecourse.add_argument('--window', type=int, default=100)
+    timecourse.set_defaults(run=bench_timecourse)
+
+    plots = subparsers.add_parser('plots', help='plotting time by worker count, dpi and image format')
+    plots.add_argument('--cards', default='program/magic_cards.json')
+    plots.add_argument('--decks', default='example/deck_folder', help='folder with deck files to repeat')
+    plots.add_argument('--num-decks', type=int, default=1000)
+    plots.add_argument('--workers', type=int, nargs='+', default=[2, 4, 8])
+    plots.add_argument('--repeat', type=int, default=1)
+    plots.set_defaults(run=bench_plots)
+
+    colors = subparsers.add_parser('colors', help='deck color classification with the card table')
+    colors.add_argument('--cards', default='program/magic_cards.json')
+    colors.add_argument('--decks', default='example/deck_folder', help='folder with deck files to repeat')
+    colors.add_argument('--num-decks', type=int, default=100000)
+    colors.set_defaults(run=bench_colors)
+
+    deck_store = subparsers.add_parser('deck-store', help='deck dictionary versus the columnar deck store')
+    deck_store.add_argument('--cards', default='program/magic_cards.json')
+    deck_store.add_argument('--decks', default='example/deck_folder', help='folder with deck files to repeat')
+    deck_store.add_argument('--num-decks', type=int, default=50000)
+    deck_store.set_defaults(run=bench_deck_store)
+
+    intervals = subparsers.add_parser('intervals', help='win rate intervals (Beta posterior and deck bootstrap)')
+    intervals.add_argument('--cards', default='program/magic_cards.json')
+    intervals.add_argument('--decks', default='example/deck_folder', help='folder with deck files to repeat')
+    intervals.add_argument('--num-decks', type=int, default=100000)
+    intervals.add_argument('--resamples', type=int, default=10000)
+    intervals.add_argument('--workers', type=int, nargs='+', default=[1, os.cpu_count() or 1])
+    intervals.set_defaults(run=bench_intervals)
+
+    names = subparsers.add_parser('names', help='correction of misspelled card names with the name index')
+    names.add_argument('--cards', default='program/magic_cards.json')
+    names.add_argument('--num-names', type=int, default=1000)
+    names.add_argument('--reference', type=int, default=200, help='number of names to correct with difflib')
+    names.set_defaults(run=bench_names)
+
+    startup = subparsers.add_parser('startup', help='startup time of the headless entry point')
+    startup.add_argument('--repeat', type=int, default=5)
+    startup.set_defaults(run=bench_startup)
+
+    imports = subparsers.add_parser('imports', help='per module import cost (python -X importtime)')
+    imports.add_argument('modules', nargs='*', default=['main', 'pipeline', 'analysis_utilities', 'visuals', 'deck_images'])
+    imports.add_argument('--top', type=int, default=8, help='number of direct imports to list per module')
+    imports.set_defaults(run=bench_imports)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
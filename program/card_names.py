@@ -0,0 +1,187 @@
+'''Fuzzy card name resolution. Card names from deck files and the cube list that are not in the card data are matched
+against an index of the normalized card names: names that only differ in case, accents, punctuation or the way a split
+card is written are corrected, and misspelled names are matched by shared letter trigrams and corrected if they are
+similar enough.'''
+
+import difflib
+import os
+import re
+import unicodedata
+from card_utilities import card_data_fingerprint
+
+NAME_INDEX_VERSION = 1
+AUTOCORRECT_THRESHOLD = 0.9 # similarity a misspelled name needs to be corrected, 1 only corrects normalized matches
+CANDIDATES = 5              # names with the most similar trigrams that are compared in full
+
+
+def normalize_name(name):
+
+    '''Lower case name without accents, with one kind of apostrophe, single spaces and split cards written as "a // b"'''
+
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(character for character in name if not unicodedata.combining(character))
+    name = name.lower().replace('’', "'").replace('æ', 'ae')
+    name = re.sub(r'\s*/+\s*', ' // ', name)
+    return ' '.join(name.split())
+
+
+def trigrams(normalized):
+    padded = f'  {normalized} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class CardNameIndex:
+
+    '''Index of the card names in magic_cards by normalized name and by trigram. The front face of a split or double
+    faced card also finds the full card name if the front face is not a card name of its own. Built with from_cards,
+    and saved to (and loaded from) a single .npz file.'''
+
+    def __init__(self, names, keys, offsets, postings, fingerprint=''):
+        import numpy as np # only needed once a card name is missing, so it is not imported on every start
+        self.names = names                  # indexed names, the normalized names first
+        self.keys = keys                    # trigrams, sorted
+        self.offsets = offsets              # postings of keys[i] are postings[offsets[i]:offsets[i + 1]]
+        self.postings = postings            # name ids
+        self.fingerprint = fingerprint
+        self.normalized = {}
+        self.targets = []                   # card name of every indexed name
+        self._trigram_ids = {key: i for i, key in enumerate(self.keys.tolist())}
+        self._sizes = np.bincount(postings, minlength=len(names))   # trigrams of every indexed name
+        self._resolved = {}
+
+    @classmethod
+    def from_cards(cls, magic_cards):
+        import numpy as np
+        names, seen = [], set()
+        for name in magic_cards:
+            front = name.split('//')[0].strip()
+            for indexed in (name, front) if front != name else (name,):
+                normalized = normalize_name(indexed)
+                if normalized not in seen and (indexed == name or front not in magic_cards):
+                    seen.add(normalized)
+                    names.append((normalized, name))
+
+        # inverted index from trigram to the ids of the names containing it
+        rows = [(trigram, name_id) for name_id, (normalized, _) in enumerate(names) for trigram in trigrams(normalized)]
+        keys, inverse = np.unique(np.array([trigram for trigram, _ in rows], dtype=str), return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        postings = np.array([name_id for _, name_id in rows], dtype=np.int32)[order]
+        offsets = np.r_[0, np.cumsum(np.bincount(inverse.reshape(-1), minlength=len(keys)))].astype(np.int64)
+
+        index = cls(np.array([normalized for normalized, _ in names], dtype=str), keys, offsets, postings, card_data_fingerprint(magic_cards))
+        index.set_targets([target for _, target in names])
+        return index
+
+    def set_targets(self, targets):
+        self.targets = list(targets)
+        self.normalized = dict(zip(self.names.tolist(), range(len(self.targets))))
+
+    def save(self, filename):
+        import numpy as np
+        with open(filename + '.tmp', 'wb') as file:
+            np.savez(file, version=NAME_INDEX_VERSION, fingerprint=self.fingerprint, names=self.names, targets=np.array(self.targets, dtype=str),
+                     keys=self.keys, offsets=self.offsets, postings=self.postings)
+        os.replace(filename + '.tmp', filename)
+
+    @classmethod
+    def load(cls, filename, fingerprint):
+
+        '''Loads a saved index, or returns None if it is missing or was built from other card data'''
+
+        import numpy as np
+        try:
+            with np.load(filename, allow_pickle=False) as data:
+                if int(data['version']) != NAME_INDEX_VERSION or str(data['fingerprint']) != fingerprint:
+                    return None
+                index = cls(data['names'], data['keys'], data['offsets'], data['postings'], fingerprint)
+                index.set_targets(data['targets'].tolist())
+                return index
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def resolve(self, name):
+
+        '''Returns the closest card names to a name with their similarity (between 0 and 1), best first. A name that
+        normalizes to a card name only returns that card name, with similarity 1.'''
+
+        ranked = self._resolved.get(name)
+        if ranked is not None:
+            return ranked
+
+        normalized = normalize_name(name)
+        if normalized in self.normalized:
+            ranked = self._resolved[name] = [(self.targets[self.normalized[normalized]], 1.0)]
+            return ranked
+
+        # count the trigrams the names share with the query, and compare the names with the most similar trigrams
+        # (Dice coefficient) in full
+        import numpy as np
+        query = trigrams(normalized)
+        ids = [self._trigram_ids[trigram] for trigram in query if trigram in self._trigram_ids]
+        scores = {}
+        if ids:
+            candidates, shared = np.unique(np.concatenate([self.postings[self.offsets[i]:self.offsets[i + 1]] for i in ids]), return_counts=True)
+            dice = shared / (len(query) + self._sizes[candidates])
+            matcher = difflib.SequenceMatcher(None, b=normalized)
+            for candidate in candidates[np.argsort(-dice, kind='stable')[:CANDIDATES]].tolist():
+                matcher.set_seq1(str(self.names[candidate]))
+                # quick_ratio is an upper bound of ratio, skip the names that cannot be one of the three closest
+                if len(scores) >= 3 and matcher.quick_ratio() <= sorted(scores.values())[-3]:
+                    continue
+                target = self.targets[candidate]
+                scores[target] = max(matcher.ratio(), scores.get(target, 0.0))
+
+        ranked = self._resolved[name] = sorted(scores.items(), key=lambda item: -item[1])[:CANDIDATES]
+        return ranked
+
+    def correct(self, name, threshold=AUTOCORRECT_THRESHOLD):
+
+        '''Returns the card name that a name missing from the card data is corrected to: the card name it normalizes to,
+        or the closest card name if that is at least threshold similar and closer than any other. Returns None if
+        there is no such card name.'''
+
+        ranked = self.resolve(name)
+        if not ranked:
+            return None
+        match, score = ranked[0]
+        if score == 1.0 or (score >= threshold and (len(ranked) == 1 or ranked[1][1] < score)):
+            return match
+        return None
+
+    def suggestions(self, name, count=3, minimum=0.6):
+
+        '''The closest card names to a name that is not corrected, for the misspellings file'''
+
+        return [match for match, score in self.resolve(name)[:count] if score >= minimum]
+
+
+def index_filename(magic_cards):
+
+    '''The cache file of the name index, next to the card store of the card data (None for card data without a store)'''
+
+    filename = getattr(magic_cards, 'filename', None)
+    return os.path.splitext(filename)[0] + '_names.npz' if filename else None
+
+
+_name_indexes = {}
+
+def name_index(magic_cards):
+
+    '''Returns the CardNameIndex of magic_cards. It is built on first use and cached next to the card store, so later
+    runs (and worker processes) load it instead of building it again.'''
+
+    index = _name_indexes.get(id(magic_cards))
+    if index is not None and index[0] is magic_cards:
+        return index[1]
+
+    fingerprint = card_data_fingerprint(magic_cards)
+    filename = index_filename(magic_cards)
+    index = CardNameIndex.load(filename, fingerprint) if filename else None
+    if index is None:
+        index = CardNameIndex.from_cards(magic_cards)
+        if filename:
+            index.save(filename)
+
+    _name_indexes.clear()
+    _name_indexes[id(magic_cards)] = (magic_cards, index)
+    return index
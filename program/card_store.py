@@ -0,0 +1,177 @@
+from collections.abc import Mapping
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+# File layout: header, a table of fixed-width records sorted by card name and a pool holding the name, color and type
+# strings of every record back to back. The header also records the size and modification time (in ns) of the JSON
+# file the store was built from, so a store is rebuilt whenever the JSON file changes.
+MAGIC = b'CUBECRD2'
+HEADER = struct.Struct('<8sI20sQq')   # magic, number of cards, sha1 of the records and pool, JSON size, JSON mtime
+RECORD = struct.Struct('<IHBHBd')     # pool offset, name length, color length, type length, flags, mana value
+INT_MANA_VALUE = 1
+
+
+class CardStore(Mapping):
+
+    '''Read-only, memory-mapped view of a card store file. Behaves like the magic_cards dictionary, but only decodes the
+    cards that are looked up.'''
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as file:
+            self._data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self._count, fingerprint, _, _ = HEADER.unpack_from(self._data, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f'{filename} is not a card store file')
+
+        self.fingerprint = fingerprint.hex()
+        self._pool = HEADER.size + self._count * RECORD.size
+        self._cache = {}
+
+    def __reduce__(self):
+        return (CardStore, (self.filename,))
+
+    def close(self):
+
+        '''Unmaps the store file, which has to happen before the file is replaced (Windows does not allow replacing a
+        mapped file). Cards that were already looked up stay available.'''
+
+        self._data.close()
+
+    def _record(self, index):
+        return RECORD.unpack_from(self._data, HEADER.size + index * RECORD.size)
+
+    def _name(self, index):
+        offset, name_length = self._record(index)[:2]
+        start = self._pool + offset
+        return self._data[start:start + name_length]
+
+    def _find(self, name):
+
+        '''Binary search of the sorted name table. Returns the record index of the name, or None.'''
+
+        key = name.encode('utf-8')
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._name(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._count and self._name(low) == key:
+            return low
+        return None
+
+    def _card(self, index):
+        offset, name_length, color_length, type_length, flags, mana_value = self._record(index)
+        start = self._pool + offset + name_length
+        color = self._data[start:start + color_length].decode('utf-8')
+        card_type = self._data[start + color_length:start + color_length + type_length].decode('utf-8')
+        if flags & INT_MANA_VALUE:
+            mana_value = int(mana_value)
+        return {'color': color, 'mana_value': mana_value, 'type': card_type}
+
+    def __getitem__(self, name):
+        if name in self._cache:
+            return self._cache[name]
+        index = self._find(name) if isinstance(name, str) else None
+        if index is None:
+            raise KeyError(name)
+        card = self._cache[name] = self._card(index)
+        return card
+
+    def __contains__(self, name):
+        return name in self._cache or (isinstance(name, str) and self._find(name) is not None)
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self._name(index).decode('utf-8')
+
+    def __len__(self):
+        return self._count
+
+
+def build_card_store(cards, filename, json_filename=None):
+
+    '''Writes a dictionary of cards (as stored in magic_cards.json) to a card store file. json_filename is the JSON file
+    the cards come from, whose size and modification time are recorded to tell when the store is out of date.'''
+
+    records, pool = bytearray(), bytearray()
+    for name in sorted(cards, key=lambda name: name.encode('utf-8')):
+        card = cards[name]
+        name_bytes, color, card_type = name.encode('utf-8'), card['color'].encode('utf-8'), card['type'].encode('utf-8')
+        flags = INT_MANA_VALUE if isinstance(card['mana_value'], int) else 0
+        records += RECORD.pack(len(pool), len(name_bytes), len(color), len(card_type), flags, card['mana_value'])
+        pool += name_bytes + color + card_type
+
+    fingerprint = hashlib.sha1(records + pool).digest()
+    source = os.stat(json_filename) if json_filename else None
+
+    # write to a temporary file first so an interrupted build never leaves a broken store behind
+    temporary = filename + '.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, len(cards), fingerprint, source.st_size if source else 0, source.st_mtime_ns if source else 0))
+        file.write(records)
+        file.write(pool)
+    os.replace(temporary, filename)
+
+
+def store_filename(json_filename):
+    return os.path.splitext(json_filename)[0] + '.bin'
+
+
+def is_current(filename, json_filename):
+
+    '''True if the card store file was built from the JSON file as it is now (same size and modification time)'''
+
+    try:
+        with open(filename, 'rb') as file:
+            magic, _, _, size, mtime = HEADER.unpack(file.read(HEADER.size))
+        source = os.stat(json_filename)
+    except (OSError, struct.error):
+        return False
+    return magic == MAGIC and size == source.st_size and mtime == source.st_mtime_ns
+
+
+def open_card_store(json_filename):
+
+    '''Opens the card store that belongs to a card JSON file. The JSON file stays the editable source: the store is
+    (re)built from it whenever it is missing or the JSON file changed since it was built.'''
+
+    filename = store_filename(json_filename)
+
+    if os.path.exists(json_filename):
+        if not is_current(filename, json_filename):
+            print(f'Building card store {filename}...')
+            with open(json_filename, 'r', encoding='utf-8') as file:
+                build_card_store(json.load(file), filename, json_filename)
+    elif not os.path.exists(filename):
+        return {}
+
+    return CardStore(filename)
+
+
+def update_card_store(card_store, new_cards, json_filename):
+
+    '''Rebuilds the card store of a JSON file after new_cards were appended to it, from the cards of the open card_store
+    (a CardStore, or a dictionary if there was none) and new_cards, without reading the JSON file again. card_store is
+    closed. Returns the new store.'''
+
+    cards = {name: card_store[name] for name in card_store}
+    cards.update(new_cards)
+    if isinstance(card_store, CardStore):
+        card_store.close()
+
+    filename = store_filename(json_filename)
+    build_card_store(cards, filename, json_filename)
+    store = CardStore(filename)
+
+    missing = [name for name in new_cards if name not in store]
+    if missing:
+        raise Exception(f"Card store {filename} is missing {len(missing)} of the new cards, e.g. {missing[0]}")
+    return store
@@ -1,72 +1,397 @@
-import requests
+import codecs
+import hashlib
 import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from card_store import open_card_store, update_card_store
 
-def fetch_cards(update=False, filename='program/magic_cards.json'):
+SCRYFALL_API_URL = 'https://api.scryfall.com'
+SCRYFALL_BULK_URL = SCRYFALL_API_URL + '/bulk-data'
+COLLECTION_BATCH_SIZE = 75 # identifiers per /cards/collection request, the most Scryfall accepts
+CHUNK_SIZE = 1 << 16
 
-    existing_cards = {}
-    if os.path.exists(filename):
-        with open(filename, 'r', encoding='utf-8') as file:
-            existing_cards = json.load(file)
+def fetch_cards(update=False, filename='program/magic_cards.json', bulk_file=None, session=None, bulk_url=SCRYFALL_BULK_URL):
+
+    '''Loads the stored card data. If update is true, new cards from the Scryfall default_cards bulk file are added to the
+    stored data. The bulk file is only downloaded if it changed since the last update (see download_bulk_cards), and
+    the new cards are appended to the JSON file instead of rewriting it. A local copy of the bulk file can be given with
+    bulk_file to update without network access. session is the HTTP client (any object with a requests-like get
+    method), by default a new requests session. The cards are served lazily from the binary card store built from the
+    JSON file.'''
 
     if not update:
         print(f'Loading data from {filename}...')
+        return open_card_store(filename)
+
+    # only the names of the stored cards are needed, which the card store looks up without loading the JSON file
+    existing_cards = open_card_store(filename)
+    new_cards, meta = {}, None
+
+    if bulk_file:
+        print(f'Reading cards from {bulk_file}...')
+        with open(bulk_file, 'rb') as file:
+            merge_bulk_cards(new_cards, iter_json_array(iter(lambda: file.read(CHUNK_SIZE), b'')), existing_cards)
+    else:
+        meta = download_bulk_cards(new_cards, existing_cards, filename, session, bulk_url)
+        if meta is None:
+            print('Card data is up to date.')
+            return existing_cards
+
+    print(f'{len(new_cards)} new cards')
+    append_cards(new_cards, filename)
+
+    # the store is rebuilt from the merged cards right away: the JSON file can have the same modification time as the
+    # store it was read from
+    magic_cards = update_card_store(existing_cards, new_cards, filename) if new_cards else existing_cards
+
+    # the bulk file meta data is written after the cards, so an interrupted update is done again next time
+    if meta:
+        meta_file = bulk_meta_filename(filename)
+        with open(meta_file + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump(meta, file, indent=4)
+        os.replace(meta_file + '.tmp', meta_file)
+
+    return magic_cards
+
+
+def fetch_used_cards(card_names, filename='program/magic_cards.json', session=None, api_url=SCRYFALL_API_URL, workers=4,
+                     requests_per_second=10):
+
+    '''Adds the cards in card_names (e.g. the cube list and the cards of every deck) that are not stored yet, looked up
+    by name with Scryfall's /cards/collection endpoint instead of downloading the full bulk file. Names are looked up
+    in batches of COLLECTION_BATCH_SIZE, by a pool of threads sharing one HTTP session (any object with a requests-like
+    post method), at no more than requests_per_second requests. Returns the card data like fetch_cards.'''
+
+    existing_cards = open_card_store(filename)
+    missing = sorted(name for name in set(card_names) if name and name not in existing_cards)
+    if not missing:
+        print('Card data is up to date.')
         return existing_cards
 
-    print('Fetching cards from Scryfall...')
-    response = requests.get('https://api.scryfall.com/bulk-data')
-    bulk_data = response.json()
+    batches = [missing[i:i + COLLECTION_BATCH_SIZE] for i in range(0, len(missing), COLLECTION_BATCH_SIZE)]
+    print(f'Looking up {len(missing)} cards on Scryfall in {len(batches)} requests...')
+    rate_limiter = RateLimiter(requests_per_second)
+    own_session = session is None
+    if own_session:
+        import requests # only needed for updates, so it is not imported on every start
+        session = requests.Session()
+
+    def lookup(batch):
+        rate_limiter.wait()
+        try:
+            response = session.post(f'{api_url}/cards/collection', json={'identifiers': [{'name': name} for name in batch]})
+            response.raise_for_status()
+            return batch, response.json().get('data', [])
+        except Exception as e:
+            print(f'Error looking up {len(batch)} cards: {e}')
+            return batch, []
+
+    new_cards = {}
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for batch, found in executor.map(lookup, batches):
+                merge_bulk_cards(new_cards, found, existing_cards)
+
+                # the names of double faced and split cards are looked up by their front face
+                requested = set(batch)
+                for card in found:
+                    front = card.get('name', '').split('//')[0].strip()
+                    if front in requested and front not in new_cards and card.get('name') in new_cards:
+                        new_cards[front] = new_cards[card['name']]
+    finally:
+        if own_session:
+            session.close()
+
+    print(f'{len(new_cards)} new cards, {len(set(missing) - set(new_cards))} names not found')
+    append_cards(new_cards, filename)
+
+    return update_card_store(existing_cards, new_cards, filename) if new_cards else existing_cards
+
+
+def bulk_meta_filename(json_filename):
+    return os.path.splitext(json_filename)[0] + '.meta.json'
+
 
-    for data in bulk_data['data']:
+def download_bulk_cards(cards, existing_cards, filename='program/magic_cards.json', session=None, bulk_url=SCRYFALL_BULK_URL):
+
+    '''Adds the cards of the Scryfall default_cards bulk file that are not in existing_cards to cards. Returns the meta
+    data of the bulk file (its updated_at time, ETag and Last-Modified date) to store next to the card data, or None if
+    the bulk file has not changed since the stored meta data was written. The download is skipped if the bulk data
+    listing shows the same updated_at time, and the bulk file is requested conditionally, so an unchanged file is
+    answered with 304 Not Modified instead of its contents.'''
+
+    if session is None:
+        import requests # only needed for updates, so it is not imported on every start
+        session = requests.Session()
+
+    meta = {}
+    meta_file = bulk_meta_filename(filename)
+    if os.path.exists(meta_file) and os.path.exists(filename):
+        with open(meta_file, 'r', encoding='utf-8') as file:
+            meta = json.load(file)
+
+    print('Fetching cards from Scryfall...')
+    response = session.get(bulk_url)
+    response.raise_for_status()
+    for data in response.json()['data']:
         if data['type'] == 'default_cards':
-            card_data_url = data['download_uri']
             break
     else:
         raise Exception("Could not find default cards in Scryfall bulk data.")
 
-    response = requests.get(card_data_url)
-    json_data = response.json()
+    if meta.get('updated_at') and meta['updated_at'] == data.get('updated_at'):
+        return None
+
+    headers = {}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+
+    # stream the bulk file so only one chunk of it (and not the full card list) is held in memory at a time
+    with session.get(data['download_uri'], headers=headers, stream=True) as response:
+        if response.status_code == 304:
+            print('The bulk file has not changed.')
+            return dict(meta, updated_at=data.get('updated_at'))
+        response.raise_for_status()
+        merge_bulk_cards(cards, iter_json_array(response.iter_content(CHUNK_SIZE)), existing_cards)
+        return {'updated_at': data.get('updated_at'), 'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified')}
+
+
+def append_cards(cards, filename):
+
+    '''Adds cards to the card JSON file. The new entries are written over the closing brace at the end of the file, in
+    the indent=4 layout of json.dump, so the file reads the same as if it had been written in full without rewriting
+    the cards that are already stored.'''
+
+    if not cards:
+        return
 
-    updated_cards = existing_cards.copy()
+    entries = json.dumps(cards, ensure_ascii=False, indent=4)[2:-2] # without the outer braces and their newlines
+    if not os.path.exists(filename):
+        with open(filename, 'w', encoding='utf-8') as file:
+            file.write('{\n' + entries + '\n}')
+        return
 
-    for card in json_data:
+    with open(filename, 'r+b') as file:
+        # read back from the end of the file up to the closing brace and the character before it
+        size = file.seek(0, os.SEEK_END)
+        start = max(0, size - 1024)
+        file.seek(start)
+        tail = file.read()
+        while start and len(tail.rstrip()) < 2:
+            start = max(0, start - 1024)
+            file.seek(start)
+            tail = file.read()
+        tail = tail.rstrip()
+        if not tail.endswith(b'}'):
+            raise ValueError(f'{filename} does not end with a JSON object')
+
+        # the entries follow the last stored card, or the opening brace of an empty object
+        body = tail[:-1].rstrip()
+        file.seek(start + len(body))
+        file.truncate()
+        file.write((('\n' if body.endswith(b'{') else ',\n') + entries + '\n}').encode('utf-8'))
+
+
+def merge_bulk_cards(cards, bulk_cards, existing_cards=()):
+
+    '''Adds the cards of a Scryfall bulk file (any iterable of card objects) to the cards dictionary, keeping only the
+    fields used by the analysis. Cards that are already in cards or in existing_cards are left untouched.'''
+
+    for card in bulk_cards:
         try:
             card_name = card.get('name')
             if not card_name:
                 continue
 
-            color_identity = card.get('color_identity', [])
-            mana_value = card.get('cmc', 0)
-            type_line = card.get('type_line', '')
-
-            if card_name not in updated_cards:
-                updated_cards[card_name] = {
-                    'color': ''.join(color_identity),
-                    'mana_value': mana_value,
-                    'type': type_line
+            if card_name not in cards and card_name not in existing_cards:
+                cards[card_name] = {
+                    'color': ''.join(card.get('color_identity', [])),
+                    'mana_value': card.get('cmc', 0),
+                    'type': card.get('type_line', '')
                 }
 
             if card.get('layout') == 'transform':
                 transformed_name = card_name.split('//')[0].strip()
-                if transformed_name not in updated_cards:
-                    updated_cards[transformed_name] = updated_cards[card_name]
+                if transformed_name not in cards and transformed_name not in existing_cards:
+                    cards[transformed_name] = cards[card_name] if card_name in cards else dict(existing_cards[card_name])
 
         except KeyError as e:
             print(f"Skipping card due to missing key: {e}")
             continue
 
-    with open(filename, 'w', encoding='utf-8') as file:
-        json.dump(updated_cards, file, ensure_ascii=False, indent=4)
+    return cards
 
-    return updated_cards
 
+def iter_json_array(chunks):
 
-def find_card_type(full_type):
-    
-    '''Takes in a card_type (str) and returns its shortened type (Artifact, Creature, Enchantment, PW, Land, Sorcery, Instant)'''
+    '''Incrementally decodes the elements of a top level JSON array from an iterable of byte (or text) chunks, yielding
+    each element as soon as it is complete. Only the undecoded remainder of the stream is kept in memory.'''
+
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buffer, pos, started = '', 0, False
+
+    def skip(pos, characters):
+        while pos < len(buffer) and buffer[pos] in characters:
+            pos += 1
+        return pos
 
-    for card_type in ['Creature', 'Artifact', 'Enchantment', 'Planeswalker', 'Land', 'Sorcery', 'Instant']:
+    for chunk in chunks:
+        buffer = buffer[pos:] + (utf8.decode(chunk) if isinstance(chunk, bytes) else chunk)
+        pos = 0
+
+        if not started:
+            pos = skip(pos, ' \t\r\n')
+            if pos == len(buffer):
+                continue
+            if buffer[pos] != '[':
+                raise ValueError('Expected a JSON array')
+            pos, started = pos + 1, True
+
+        while True:
+            pos = skip(pos, ' \t\r\n,')
+            if pos == len(buffer):
+                break
+            if buffer[pos] == ']':
+                return
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break # element continues in the next chunk
+
+            # a number is only complete once the delimiter after it has been read
+            if not isinstance(element, (dict, list, str)):
+                delimiter = skip(end, ' \t\r\n')
+                if buffer[delimiter:delimiter + 1] not in (',', ']'):
+                    break
+            yield element
+            pos = end
+
+    # only a trailing number (or a truncated stream) can be left over at this point
+    remainder = buffer[pos:].strip()
+    if started and remainder and remainder[0] != ']':
+        element, end = decoder.raw_decode(remainder)
+        yield element
+        remainder = remainder[end:].lstrip(' \t\r\n,')
+    if not started or remainder != ']':
+        raise ValueError('Unexpected end of JSON array')
+
+
+class RateLimiter:
+
+    '''Spaces out calls to wait() so that at most requests_per_second calls pass per second, shared between threads'''
+
+    def __init__(self, requests_per_second):
+        self.interval = 1 / requests_per_second if requests_per_second else 0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def card_data_fingerprint(magic_cards):
+
+    '''Returns a hash identifying the card data, used to invalidate results computed from it'''
+
+    fingerprint = getattr(magic_cards, 'fingerprint', None)
+    if fingerprint:
+        return fingerprint
+    return hashlib.sha1(json.dumps(magic_cards, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+# card types in the order find_card_type checks them; the type enum of a card is its index here, or NO_TYPE
+CARD_TYPES = ['Creature', 'Artifact', 'Enchantment', 'Planeswalker', 'Land', 'Sorcery', 'Instant']
+LAND = CARD_TYPES.index('Land')
+NO_TYPE = len(CARD_TYPES)
+COLOR_BITS = {'W': 1, 'U': 2, 'B': 4, 'R': 8, 'G': 16}
+SPLASH_THRESHOLD = 0.15 # a color in less than this share of the nonland cards of a deck is a splash
+INTERVAL_COLUMNS = ['Win % Low', 'Win % High', 'Norm % Low', 'Norm % High'] # win rate intervals of the result tables
+
+
+class CardTable:
+
+    '''Precomputed attributes of the cards in magic_cards, indexed by an interned integer card id: the card type as an
+    index into CARD_TYPES, the color identity as a bitmask of COLOR_BITS and the mana value. A card is added the first
+    time its id is looked up, so the card data is only decoded for cards that are used.'''
+
+    def __init__(self, magic_cards):
+        self.magic_cards = magic_cards
+        self.ids = {}
+        self.names, self.types, self.colors, self.mana_values = [], [], [], []
+
+    def get_id(self, name):
+
+        '''Returns the id of a card, or None if it is not in magic_cards'''
+
+        card_id = self.ids.get(name)
+        if card_id is None:
+            card = self.magic_cards.get(name)
+            if not card:
+                return None
+            card_id = self.ids[name] = len(self.names)
+            self.names.append(name)
+            self.types.append(card_type_index(card['type']))
+            self.colors.append(color_mask(card['color']))
+            self.mana_values.append(card['mana_value'])
+        return card_id
+
+    def id(self, name):
+
+        '''Returns the id of a card, raising KeyError like magic_cards[name] if it is not in magic_cards'''
+
+        card_id = self.get_id(name)
+        if card_id is None:
+            raise KeyError(name)
+        return card_id
+
+
+_card_tables = {}
+
+def card_table(magic_cards):
+
+    '''Returns the CardTable of magic_cards, building it on first use. The table is kept for as long as the card data is
+    in use, so every caller shares the attributes computed so far.'''
+
+    table = _card_tables.get(id(magic_cards))
+    if table is None or table.magic_cards is not magic_cards:
+        _card_tables.clear()
+        table = _card_tables[id(magic_cards)] = CardTable(magic_cards)
+    return table
+
+
+def card_type_index(full_type):
+
+    '''Returns the index in CARD_TYPES of the shortened type of a card (see find_card_type), or NO_TYPE'''
+
+    for index, card_type in enumerate(CARD_TYPES):
         if card_type in full_type:
-            return card_type
+            return index
+    return NO_TYPE
+
+
+def color_mask(color):
+    mask = 0
+    for symbol in color:
+        mask |= COLOR_BITS.get(symbol, 0)
+    return mask
+
+
+def find_card_type(full_type):
+
+    '''Takes in a card_type (str) and returns its shortened type (Artifact, Creature, Enchantment, PW, Land, Sorcery, Instant)'''
 
-    return None
\ No newline at end of file
+    index = card_type_index(full_type)
+    return CARD_TYPES[index] if index != NO_TYPE else None
@@ -0,0 +1,125 @@
+'''Command line entry point for running the analysis without the GUI, e.g. on a server or from a scheduled job:
+
+    python program/cli.py analyze --decks deck_folder --cube cube_list.txt --out results --date --filter 5
+
+Options that are not given are taken from the settings file (by default the settings saved by the GUI).
+'''
+
+import argparse
+import json
+import os
+import sys
+
+PROGRAM_FOLDER = os.path.dirname(os.path.abspath(__file__))
+SETTINGS_FILE = os.path.join(PROGRAM_FOLDER, 'settings.json')
+
+
+def add_flag(parser, name, help):
+
+    '''Adds --name and --no-name (argparse.BooleanOptionalAction needs Python 3.9). The setting is None if neither is
+    given, so it is taken from the settings file.'''
+
+    dest = name.replace('-', '_')
+    parser.add_argument(f'--{name}', dest=dest, action='store_true', help=help)
+    parser.add_argument(f'--no-{name}', dest=dest, action='store_false', help=argparse.SUPPRESS)
+    parser.set_defaults(**{dest: None})
+
+
+def add_analysis_options(parser):
+
+    '''The options of the analysis, shared by the analyze and watch commands'''
+
+    parser.add_argument('--decks', dest='deck_folder', help='folder containing a .txt file for each deck')
+    parser.add_argument('--cube', dest='cube_file', help='text file listing all cube cards, one per line')
+    parser.add_argument('--out', dest='save_folder', help='folder where results and images are saved')
+    add_flag(parser, 'images', 'generate deck images (--no-images to turn off)')
+    add_flag(parser, 'date', 'time trend analysis (--no-date to turn off)')
+    parser.add_argument('--filter', help='only report cards played in more than this many decks')
+    parser.add_argument('--window', help='window of the time trend analysis')
+    parser.add_argument('--splash-threshold', dest='splash_threshold',
+                        help='colors in less than this share of the nonland cards of a deck count as a splash (default 0.15)')
+    parser.add_argument('--autocorrect',
+                        help='correct misspelled card names at least this similar to a card name, e.g. 0.9 (default none: only suggest card names)')
+    parser.add_argument('--intervals', choices=['beta', 'bootstrap', 'none'],
+                        help='confidence intervals of the win rates: Beta posterior, deck bootstrap or none (default)')
+    parser.add_argument('--resamples', help='number of random draws for the intervals (default 2000)')
+    parser.add_argument('--workers', help='number of worker processes for parsing decks, intervals, plots and deck images')
+    parser.add_argument('--format', dest='output_format', choices=['csv', 'parquet', 'none'],
+                        help='file format of the result tables (default csv), none only saves the plots')
+    parser.add_argument('--dpi', help='resolution of the plots (default 300)')
+    parser.add_argument('--image-format', dest='image_format', choices=['png', 'svg', 'webp'], help='file format of the plots (default png)')
+    parser.add_argument('--settings', default=SETTINGS_FILE, help='settings file with defaults for the options (default: the GUI settings)')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='cli.py', description='CubeAnalyser - cube draft analysis')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    analyze = subparsers.add_parser('analyze', help='run the full analysis')
+    add_analysis_options(analyze)
+    add_flag(analyze, 'update', 'update card data from Scryfall (--no-update to turn off)')
+    analyze.add_argument('--update-mode', dest='update_mode', choices=['bulk', 'used'],
+                         help='bulk downloads every card (default), used only looks up the cards of the cube list and the decks')
+    analyze.add_argument('--profile', action='store_true', help='write a cProfile of the run to profile.pstats in the output folder')
+    analyze.add_argument('--trace-memory', action='store_true', help='record the peak Python allocations of each stage (slower)')
+
+    watch = subparsers.add_parser('watch', help='analyze, then keep the results up to date while deck files change')
+    add_analysis_options(watch)
+    watch.add_argument('--interval', type=float, default=5.0, help='seconds between checks of the deck folder (default 5)')
+    watch.add_argument('--cycles', type=int, default=None, help='stop after this many checks (default: run until Ctrl+C)')
+    watch.set_defaults(update=None, update_mode=None)
+
+    return parser.parse_args(argv)
+
+
+def load_settings(args):
+
+    '''Merges the settings file with the options given on the command line. Paths are made absolute, since the analysis
+    runs from the CubeAnalyser folder.'''
+
+    settings = {}
+    if args.settings and os.path.exists(args.settings):
+        with open(args.settings, 'r') as f:
+            settings = json.load(f)
+        # paths in the settings file are relative to the CubeAnalyser folder, like in the GUI
+        root = os.path.dirname(PROGRAM_FOLDER)
+        for key in ['deck_folder', 'cube_file', 'save_folder']:
+            if settings.get(key):
+                settings[key] = os.path.join(root, settings[key])
+
+    for key in ['deck_folder', 'cube_file', 'save_folder', 'update', 'update_mode', 'images', 'date', 'filter', 'window', 'workers', 'output_format', 'dpi', 'image_format', 'splash_threshold',
+                'autocorrect', 'intervals', 'resamples']:
+        value = getattr(args, key)
+        if value is not None:
+            settings[key] = os.path.abspath(value) if key in ['deck_folder', 'cube_file', 'save_folder'] else value
+
+    return settings
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    settings = load_settings(args)
+
+    # card data, misspellings and card images are stored relative to the CubeAnalyser folder
+    os.chdir(os.path.dirname(PROGRAM_FOLDER))
+
+    # imported here so that parsing the arguments stays fast
+    from pipeline import run_pipeline, AnalysisError
+
+    try:
+        if args.command == 'watch':
+            from watch import watch
+            print(f'Watching {settings.get("deck_folder")} for changes, press Ctrl+C to stop')
+            watch(settings, interval=args.interval, cycles=args.cycles)
+            return 0
+        run_pipeline(settings, profile=args.profile, trace_memory=args.trace_memory)
+    except AnalysisError as e:
+        print(f'Error: {e}', file=sys.stderr)
+        return 1
+
+    print('Analysis complete!')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
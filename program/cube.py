@@ -0,0 +1,67 @@
+import hashlib
+
+# The cards of a cube list. The hash identifies the cube by its cards only (not their order, duplicates or the file
+# they were read from), so it can be used as a cache key of results that depend on the cube. CUBE_VERSION is part of
+# the hash: changing how cubes are hashed or filtered changes every hash, so results cached by hash are not reused.
+CUBE_VERSION = 1
+
+
+class Cube:
+
+    '''The cards of a cube list as a frozen set, with the cards that were listed more than once. Membership tests are
+    O(1), and mask tests a whole sequence of card names (e.g. the card ids of a DeckStore) at once. An empty cube (no
+    cube list) is false and does not filter any card.'''
+
+    def __init__(self, cards=(), source=None):
+        self.names = []                     # cards in the order of the cube list, without duplicates
+        self.duplicates = {}                # card -> number of times it is listed, for the cards listed more than once
+        seen = set()
+        for card in cards:
+            if card in seen:
+                self.duplicates[card] = self.duplicates.get(card, 1) + 1
+            else:
+                seen.add(card)
+                self.names.append(card)
+        self.cards = frozenset(seen)
+        self.source = source
+        self.hash = hashlib.sha1('\n'.join([f'cube {CUBE_VERSION}'] + sorted(self.cards)).encode('utf-8')).hexdigest()
+
+    def __contains__(self, card):
+        return card in self.cards
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.cards)
+
+    def __eq__(self, other):
+        return isinstance(other, Cube) and self.hash == other.hash
+
+    def __hash__(self):
+        return hash(self.hash)
+
+    def __repr__(self):
+        return f'Cube({len(self)} cards, {self.hash[:12]})'
+
+    def allows(self, card):
+
+        '''True if card passes the cube filter: it is in the cube, or there is no cube'''
+
+        return not self.cards or card in self.cards
+
+    def mask(self, card_names):
+
+        '''Boolean array of the cards in card_names that pass the cube filter'''
+
+        import numpy as np # only needed by the analyses, so it is not imported on every start
+        if not self.cards:
+            return np.ones(len(card_names), dtype=bool)
+        return np.fromiter((card in self.cards for card in card_names), dtype=bool, count=len(card_names))
+
+
+def as_cube(cube):
+
+    '''Returns cube as a Cube, also accepting a list of card names (or None for no cube)'''
+
+    return cube if isinstance(cube, Cube) else Cube(cube or ())
@@ -1,25 +1,115 @@
 from PIL import Image
 import requests
 from io import BytesIO
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import time
 from card_utilities import *
 
 CARD_WIDTH = 488
 CARD_HEIGHT = 680
+TILE_FOLDER = 'program/card_images/tiles'
 
-def create_deck_image(deck_list_dict, magic_cards, deck_id=0, output_file='deck_image.png'):
+
+class TileCache:
+
+    '''Bounded LRU cache of decoded card tiles (card images at the final tile size), shared by all the decks of a
+    make_deck_images run. Keeps track of its hit rate and of the local loading time saved by the hits.'''
+
+    def __init__(self, memory_budget_mb=256, image_folder='program/card_images', tile_folder=TILE_FOLDER):
+        self.memory_budget = memory_budget_mb * 2**20
+        self.image_folder = image_folder
+        self.tile_folder = tile_folder
+        self.memory = 0
+        self.hits, self.misses, self.time_saved = 0, 0, 0.0
+        self._tiles = OrderedDict()
+        self._load_times = {}
+
+    def get(self, card_name):
+        key = sanitize_filename(card_name)
+
+        if key in self._tiles:
+            self._tiles.move_to_end(key)
+            self.hits += 1
+            self.time_saved += self._load_times[key]
+            return self._tiles[key]
+
+        # only local loading (decoding and resizing) counts as saved by later hits, not downloading a missing image
+        stored = os.path.exists(os.path.join(self.tile_folder, key)) or os.path.exists(os.path.join(self.image_folder, key))
+        start = time.perf_counter()
+        tile = load_card_tile(card_name, self.image_folder, self.tile_folder)
+        load_time = time.perf_counter() - start if stored else 0.0
+        self.misses += 1
+
+        if tile is not None:
+            self._tiles[key] = tile
+            self._load_times[key] = load_time
+            self.memory += tile_memory(tile)
+
+            # evict the least recently used tiles once the memory budget is exceeded
+            while self.memory > self.memory_budget and len(self._tiles) > 1:
+                evicted_key, evicted = self._tiles.popitem(last=False)
+                del self._load_times[evicted_key]
+                self.memory -= tile_memory(evicted)
+
+        return tile
+
+    def report(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0
+        print(f'Card tile cache: {self.hits} of {lookups} lookups were hits ({hit_rate:.1%}), {self.time_saved:.1f} s of image loading saved')
+
+
+def tile_memory(tile):
+    return tile.width * tile.height * len(tile.getbands())
+
+
+def load_card_tile(card_name, image_folder='program/card_images', tile_folder=TILE_FOLDER):
+
+    '''Returns the tile of a card. Card images that are not stored at the tile size (e.g. custom cards) are resized once
+    and the tile is stored in tile_folder, so later runs skip the resampling.'''
+
+    file_name = sanitize_filename(card_name)
+    tile_path = os.path.join(tile_folder, file_name)
+
+    if os.path.exists(tile_path):
+        try:
+            with Image.open(tile_path) as tile:
+                return tile.convert('RGB')
+        except Exception as e:
+            print(f"Error while opening of {tile_path}, will make a new tile. ({e})")
+
+    local_path = os.path.join(image_folder, file_name)
+    if os.path.exists(local_path):
+        try:
+            with Image.open(local_path) as image:
+                if image.size == (CARD_WIDTH, CARD_HEIGHT) and image.mode == 'RGB':
+                    image.load()
+                    return image.copy()
+        except Exception:
+            pass # fetch_card_image reports the error and downloads the image again
+
+    tile = fetch_card_image(card_name, image_folder)
+    if tile is not None:
+        os.makedirs(tile_folder, exist_ok=True)
+        tile.save(tile_path)
+    return tile
+
+
+def create_deck_image(deck_list_dict, magic_cards, deck_id=0, output_file='deck_image.png', tile_cache=None):
     
     deck = deck_list_dict[deck_id]['main']
     categorized_cards = { 'land': [], 0: [], 1: [], 2: [], 3: [], 4: [], 5: [], 6: [], 7: [] }
 
+    table = card_table(magic_cards)
     for card_name in deck:
-        card_info = magic_cards.get(card_name, None)
-        if not card_info:
+        card_id = table.get_id(card_name)
+        if card_id is None:
             continue
 
-        card_type = find_card_type(card_info['type'])
-        mana_value = int(card_info['mana_value'])
+        mana_value = int(table.mana_values[card_id])
 
-        if card_type == 'Land':
+        if table.types[card_id] == LAND:
             categorized_cards['land'].append(card_name)
         else:
             key = mana_value if mana_value <= 6 else 7
@@ -29,7 +119,7 @@ def create_deck_image(deck_list_dict, magic_cards, deck_id=0, output_file='deck_
     columns = []
     for key in ordered_keys:
         card_names = categorized_cards[key]
-        images = [fetch_card_image(card_name) for card_name in card_names if fetch_card_image(card_name)]
+        images = [image for image in map(tile_cache.get if tile_cache else fetch_card_image, card_names) if image]
         if images:
             columns.append(images)
 
@@ -60,7 +150,11 @@ def sanitize_filename(card_name):
     clean_name = clean_name.replace(" ", "_").replace("'", "").replace(",", "").replace("/", "")
     return clean_name + '.png'
 
-def fetch_card_image(card_name, folder='program/card_images'):
+def fetch_card_image(card_name, folder='program/card_images', session=requests, api_url=SCRYFALL_API_URL, rate_limiter=None):
+
+    '''Returns the resized image of a card, downloading it from Scryfall (through session, any object with a requests-like
+    get method) if it is not stored in folder yet.'''
+
     os.makedirs(folder, exist_ok=True)
     file_name = sanitize_filename(card_name)
     local_path = os.path.join(folder, file_name)
@@ -72,12 +166,15 @@ def fetch_card_image(card_name, folder='program/card_images'):
             print(f"Error while opening of {local_path}, will try to fetch new image. ({e})")
 
     try:
-        url = f'https://api.scryfall.com/cards/named?exact={card_name}'
-        response = requests.get(url)
+        # only the API lookup is rate limited, the image itself is served from Scryfall's file servers
+        if rate_limiter:
+            rate_limiter.wait()
+        response = session.get(f'{api_url}/cards/named', params={'exact': card_name})
         response.raise_for_status()
         data = response.json()
         image_url = data['image_uris']['normal']
-        image_response = requests.get(image_url)
+        image_response = session.get(image_url)
+        image_response.raise_for_status()
         image = Image.open(BytesIO(image_response.content))
         image = resize_image(image)
         image.save(local_path)
@@ -87,6 +184,49 @@ def fetch_card_image(card_name, folder='program/card_images'):
         return None
 
 
+def prefetch_card_images(deck_dict, magic_cards, folder='program/card_images', workers=8, requests_per_second=10,
+                         session=None, api_url=SCRYFALL_API_URL):
+
+    '''Downloads the images of every card used in the decks that is not stored in folder yet. Each image is requested once,
+    by a pool of threads sharing one HTTP session, at no more than requests_per_second requests to the Scryfall API.
+    Returns the number of images that were fetched.'''
+
+    # one download per image file, even if several card names map to the same file
+    missing = {}
+    for deck in deck_dict.values():
+        for card_name in deck['main']:
+            if not magic_cards.get(card_name):
+                continue
+            file_name = sanitize_filename(card_name)
+            if file_name not in missing and not os.path.exists(os.path.join(folder, file_name)):
+                missing[file_name] = card_name
+
+    if not missing:
+        return 0
+
+    print(f'Fetching {len(missing)} card images from Scryfall...')
+    rate_limiter = RateLimiter(requests_per_second)
+    own_session = session is None
+    if own_session:
+        session = requests.Session()
+
+    def fetch(card_name):
+        image = fetch_card_image(card_name, folder, session, api_url, rate_limiter)
+        if image is not None:
+            image.close()
+            return True
+        return False
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            fetched = sum(executor.map(fetch, missing.values()))
+    finally:
+        if own_session:
+            session.close()
+
+    return fetched
+
+
 def resize_image(image, width=CARD_WIDTH, height=CARD_HEIGHT):
     image = image.convert("RGBA")
     image.thumbnail((width, height), Image.ANTIALIAS)
@@ -97,28 +237,109 @@ def resize_image(image, width=CARD_WIDTH, height=CARD_HEIGHT):
     return background.convert("RGB")
 
 
-def make_deck_images(decklist_folder, deck_dict, magic_cards, save_folder):
-    deck_files = [f for f in os.listdir(decklist_folder) if f.endswith('.txt')]
+def ensure_tile(card_name, image_folder='program/card_images', tile_folder=TILE_FOLDER):
+
+    '''Makes sure a card can be loaded without resampling, i.e. that its image is stored at the tile size or that a tile
+    was made for it. Only reads the image headers of cards that are ready.'''
+
+    file_name = sanitize_filename(card_name)
+    if os.path.exists(os.path.join(tile_folder, file_name)):
+        return
+    try:
+        with Image.open(os.path.join(image_folder, file_name)) as image:
+            if image.size == (CARD_WIDTH, CARD_HEIGHT) and image.mode == 'RGB':
+                return
+    except Exception:
+        pass
+    load_card_tile(card_name, image_folder, tile_folder)
+
+
+def render_deck_image(deck_dict, magic_cards, tile_cache, deck_id, output_path):
+
+    '''Renders the image of one deck. Returns an error message (None on success) and the tile cache hits, misses and
+    time saved while rendering it.'''
+
+    hits, misses, time_saved = tile_cache.hits, tile_cache.misses, tile_cache.time_saved
+    try:
+        create_deck_image(deck_list_dict=deck_dict, magic_cards=magic_cards, deck_id=deck_id, output_file=output_path, tile_cache=tile_cache)
+        error = None
+    except Exception as e:
+        error = str(e)
+    return error, (tile_cache.hits - hits, tile_cache.misses - misses, tile_cache.time_saved - time_saved)
+
+
+_render_state = {}
+
+def _init_render_worker(deck_dict, magic_cards, tile_cache_mb):
+    _render_state.update(deck_dict=deck_dict, magic_cards=magic_cards, tile_cache=TileCache(tile_cache_mb))
+
+def _render_in_worker(deck_id, output_path):
+    return render_deck_image(deck_id=deck_id, output_path=output_path, **_render_state)
+
+
+def print_progress(done, total, name):
+    percent = done * 100 / total
+    print(f'Completed images for {done} of {total} decks ({percent:.1f}%)', end='\n' if done == total else '\r', flush=True)
+
+
+def make_deck_images(deck_dict, magic_cards, save_folder, download_workers=8, requests_per_second=10, tile_cache_mb=256,
+                     render_workers=1, progress=print_progress):
 
-    deck_ids = list(deck_dict.keys())
-    total = len(deck_files)
+    '''Renders an image of every deck whose image is missing or older than its deck file. With render_workers more than
+    1 the images are rendered by a pool of processes working through a queue of decks. progress is called with the
+    number of finished decks, the total and the deck file after every deck.'''
 
     output_folder = os.path.join(save_folder, 'deck_images')
     os.makedirs(output_folder, exist_ok=True)
-    
-    for deck_id, deck_file in zip(deck_ids, deck_files):
-        image_name = os.path.splitext(deck_file)[0] + '.png'
-        output_path = os.path.join(output_folder, image_name)
 
+    tasks = []
+    for deck_id, deck in deck_dict.items():
+        output_path = os.path.join(output_folder, deck['id'] + '.png')
         try:
-            if not os.path.exists(output_path):
-                create_deck_image(deck_list_dict=deck_dict, magic_cards=magic_cards,
-                                deck_id=deck_id, output_file=output_path)
-                
-            percent = (deck_id) * 100 / total
-            print(f'Completed images for {deck_id} of {total} decks ({percent:.1f}%)')
-            print('\x1b[F', end='')
+            outdated = not os.path.exists(output_path) or os.path.getmtime(output_path) < os.path.getmtime(deck['file'])
+        except OSError:
+            outdated = True # the deck file was removed or renamed since it was read, render the deck as it was read
+        if outdated:
+            tasks.append((deck_id, os.path.basename(deck['file']), output_path))
 
-        except Exception as e:
-            print(f'Error with image for {deck_file}: {e}')
-    
\ No newline at end of file
+    prefetch_card_images({deck_id: deck_dict[deck_id] for deck_id, _, _ in tasks}, magic_cards, workers=download_workers, requests_per_second=requests_per_second)
+    tile_cache = TileCache(tile_cache_mb)
+
+    def finished(done, deck_file, error, cache_stats):
+        if error:
+            print(f'Error with image for {deck_file}: {error}')
+        tile_cache.hits += cache_stats[0]
+        tile_cache.misses += cache_stats[1]
+        tile_cache.time_saved += cache_stats[2]
+        if progress:
+            progress(done, len(tasks), deck_file)
+
+    if render_workers is None:
+        render_workers = os.cpu_count() or 1
+    render_workers = min(render_workers, len(tasks))
+
+    if render_workers <= 1:
+        for done, (deck_id, deck_file, output_path) in enumerate(tasks, 1):
+            error, _ = render_deck_image(deck_dict, magic_cards, tile_cache, deck_id, output_path)
+            finished(done, deck_file, error, (0, 0, 0))
+    else:
+        # resize every card once up front, so the workers only decode ready-made tiles from disk
+        for card_name in {card for deck_id, _, _ in tasks for card in deck_dict[deck_id]['main'] if magic_cards.get(card)}:
+            ensure_tile(card_name)
+
+        executor = ProcessPoolExecutor(max_workers=render_workers, initializer=_init_render_worker, initargs=(deck_dict, magic_cards, tile_cache_mb))
+        futures = {}
+        try:
+            for deck_id, deck_file, output_path in tasks:
+                futures[executor.submit(_render_in_worker, deck_id, output_path)] = deck_file
+            for done, future in enumerate(as_completed(futures), 1):
+                error, cache_stats = future.result()
+                finished(done, futures[future], error, cache_stats)
+        finally:
+            # drop the queued decks if the run stops early (e.g. when progress raises to cancel it). Cancelled by hand,
+            # as shutdown(cancel_futures=True) needs Python 3.9
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    tile_cache.report()
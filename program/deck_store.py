@@ -0,0 +1,194 @@
+import numpy as np
+import os
+
+# Columnar form of the parsed decks. Decks are rows of the deck columns (in the order of the deck dictionary), and the
+# cards, players and archetypes of the decks are long tables of (deck index, interned id) rows ordered by deck.
+DECK_STORE_FILE = 'deck_store.npz'
+DECK_STORE_VERSION = 1
+COLORS = ['White', 'Blue', 'Black', 'Red', 'Green']
+MAIN, SIDE = 0, 1
+
+
+def first_appearance(labels):
+
+    '''Renumbers a sequence of integer labels in order of first appearance. Returns the renumbered labels and the
+    original label of every new number.'''
+
+    unique, first, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return rank[inverse.reshape(-1)], unique[order]
+
+
+class DeckStore:
+
+    '''The parsed decks as numpy columns with interned card, player and archetype names, so the analyses work on
+    arrays instead of a dictionary per deck. Built from the deck dictionary with from_decks, and saved to (and loaded
+    from) a single .npz file.'''
+
+    def __init__(self, columns):
+        self.card_names = list(columns['card_names'])
+        self.player_names = list(columns['player_names'])
+        self.archetype_names = list(columns['archetype_names'])
+
+        # one row per deck
+        self.keys = columns['keys']                 # key of the deck in the deck dictionary
+        self.ids = columns['ids']                   # deck file name without extension
+        self.files = columns['files']
+        self.dates = columns['dates']               # empty if the decks have no dates
+        self.win = columns['win']
+        self.loss = columns['loss']
+        self.color = columns['color']               # number of nonland cards of each of the COLORS
+        self.splash = columns['splash']
+
+        # long tables, ordered by deck
+        self.card_deck = columns['card_deck']
+        self.card_id = columns['card_id']
+        self.card_zone = columns['card_zone']       # MAIN or SIDE
+        self.card_count = columns['card_count']
+        self.player_deck = columns['player_deck']
+        self.player_id = columns['player_id']
+        self.archetype_deck = columns['archetype_deck']
+        self.archetype_id = columns['archetype_id']
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def has_dates(self):
+        return len(self.dates) == len(self.keys)
+
+    @classmethod
+    def from_decks(cls, deck_dict):
+
+        '''Builds the store from a deck dictionary as returned by extract_decklists. Card ids are given in order of
+        first appearance (main deck before sideboard), and the cards of a deck keep the order of their first copy.'''
+
+        card_ids, player_ids, archetype_ids = {}, {}, {}
+        card_deck, card_id, card_zone, card_count = [], [], [], []
+        player_deck, player_id, archetype_deck, archetype_id = [], [], [], []
+        keys, ids, files, dates, win, loss, color, splash = [], [], [], [], [], [], [], []
+
+        for index, (key, deck) in enumerate(deck_dict.items()):
+            keys.append(key)
+            ids.append(deck.get('id', str(key)))
+            files.append(deck.get('file', ''))
+            if 'date' in deck:
+                dates.append(deck['date'])
+            win.append(deck['record'][0])
+            loss.append(deck['record'][1])
+            color.append([deck['color'].get(c, 0) for c in COLORS])
+            splash.append([deck['splash'].get(c, 0) for c in COLORS])
+
+            for zone, cards in ((MAIN, deck['main']), (SIDE, deck['side'])):
+                counts = {}
+                for card in cards:
+                    counts[card] = counts.get(card, 0) + 1
+                for card, count in counts.items():
+                    card_deck.append(index)
+                    card_id.append(card_ids.setdefault(card, len(card_ids)))
+                    card_zone.append(zone)
+                    card_count.append(count)
+
+            for player in deck['player']:
+                player_deck.append(index)
+                player_id.append(player_ids.setdefault(player, len(player_ids)))
+            for archetype in deck['archetypes']:
+                archetype_deck.append(index)
+                archetype_id.append(archetype_ids.setdefault(archetype, len(archetype_ids)))
+
+        return cls({'card_names': list(card_ids), 'player_names': list(player_ids), 'archetype_names': list(archetype_ids),
+                    'keys': np.array(keys, dtype=np.int64), 'ids': np.array(ids, dtype=str), 'files': np.array(files, dtype=str),
+                    'dates': np.array(dates if len(dates) == len(keys) else [], dtype=str),
+                    'win': np.array(win, dtype=np.float64), 'loss': np.array(loss, dtype=np.float64),
+                    'color': np.array(color, dtype=np.int16).reshape(-1, len(COLORS)),
+                    'splash': np.array(splash, dtype=np.int16).reshape(-1, len(COLORS)),
+                    'card_deck': np.array(card_deck, dtype=np.int32), 'card_id': np.array(card_id, dtype=np.int32),
+                    'card_zone': np.array(card_zone, dtype=np.int8), 'card_count': np.array(card_count, dtype=np.int16),
+                    'player_deck': np.array(player_deck, dtype=np.int32), 'player_id': np.array(player_id, dtype=np.int32),
+                    'archetype_deck': np.array(archetype_deck, dtype=np.int32), 'archetype_id': np.array(archetype_id, dtype=np.int32)})
+
+    def to_decks(self):
+
+        '''Rebuilds the deck dictionary (e.g. for the deck images)'''
+
+        deck_dict = {}
+        for index, key in enumerate(self.keys.tolist()):
+            deck_dict[key] = {'main': [], 'side': [], 'player': [], 'color': dict(zip(COLORS, self.color[index].tolist())),
+                              'splash': dict(zip(COLORS, self.splash[index].tolist())), 'archetypes': [], 'record': [float(self.win[index]), float(self.loss[index])],
+                              'id': str(self.ids[index]), 'file': str(self.files[index])}
+            if self.has_dates:
+                deck_dict[key]['date'] = str(self.dates[index])
+
+        decks = list(deck_dict.values())
+        for deck, card, zone, count in zip(self.card_deck.tolist(), self.card_id.tolist(), self.card_zone.tolist(), self.card_count.tolist()):
+            decks[deck]['main' if zone == MAIN else 'side'].extend([self.card_names[card]] * count)
+        for deck, player in zip(self.player_deck.tolist(), self.player_id.tolist()):
+            decks[deck]['player'].append(self.player_names[player])
+        for deck, archetype in zip(self.archetype_deck.tolist(), self.archetype_id.tolist()):
+            decks[deck]['archetypes'].append(self.archetype_names[archetype])
+
+        return deck_dict
+
+    def deck_labels(self):
+
+        '''The archetype each deck is normalized by: 'Pure <archetype>' for decks with a single archetype, and otherwise
+        the last archetype of the deck. Returns the label id of every deck and the label names, in order of first
+        appearance.'''
+
+        counts = np.bincount(self.archetype_deck, minlength=len(self))
+        last = self.archetype_id[np.cumsum(counts) - 1]
+        labels = np.where(counts == 1, last + len(self.archetype_names), last)
+        labels, unique = first_appearance(labels)
+        return labels, [self.label_name(label) for label in unique.tolist()]
+
+    def archetype_rows(self):
+
+        '''The archetype rows counted by the archetype analysis: a 'Pure <archetype>' row before the archetype of every
+        deck with a single archetype, then the archetypes of the deck. Returns the deck index and label id of every row
+        and the label names, in order of first appearance.'''
+
+        counts = np.bincount(self.archetype_deck, minlength=len(self))
+        pure = np.flatnonzero(counts[self.archetype_deck] == 1)
+        rows = np.arange(len(self.archetype_deck))
+
+        # sort the pure rows in just before the row of their archetype
+        order = np.argsort(np.concatenate([2 * rows + 1, 2 * pure]), kind='stable')
+        decks = np.concatenate([self.archetype_deck, self.archetype_deck[pure]])[order]
+        labels = np.concatenate([self.archetype_id, self.archetype_id[pure] + len(self.archetype_names)])[order]
+        labels, unique = first_appearance(labels)
+        return decks, labels, [self.label_name(label) for label in unique.tolist()]
+
+    def label_name(self, label):
+        if label < len(self.archetype_names):
+            return self.archetype_names[label]
+        return 'Pure ' + self.archetype_names[label - len(self.archetype_names)]
+
+    def save(self, filename):
+
+        '''Writes the store to a single uncompressed .npz file, which loads without parsing'''
+
+        columns = {name: value for name, value in vars(self).items() if isinstance(value, np.ndarray)}
+        with open(filename + '.tmp', 'wb') as file:
+            np.savez(file, version=DECK_STORE_VERSION, card_names=np.array(self.card_names, dtype=str),
+                     player_names=np.array(self.player_names, dtype=str), archetype_names=np.array(self.archetype_names, dtype=str), **columns)
+        os.replace(filename + '.tmp', filename)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename, allow_pickle=False) as data:
+            if int(data['version']) != DECK_STORE_VERSION:
+                raise ValueError(f'{filename} was written by another version of CubeAnalyser')
+            columns = {name: data[name] for name in data.files}
+        columns['card_names'] = columns['card_names'].tolist()
+        columns['player_names'] = columns['player_names'].tolist()
+        columns['archetype_names'] = columns['archetype_names'].tolist()
+        return cls(columns)
+
+
+def as_deck_store(decks):
+
+    '''Returns decks as a DeckStore, converting a deck dictionary if needed'''
+
+    return decks if isinstance(decks, DeckStore) else DeckStore.from_decks(decks)
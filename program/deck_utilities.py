@@ -1,8 +1,51 @@
 import os
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
 from card_utilities import *
+from card_names import NAME_INDEX_VERSION, name_index
+from cube import Cube
 
-def make_cube_list(infile, magic_cards, update = False):
-    '''Parses the cube list file and writes any missing cards to misspellings.txt'''
+DECK_CACHE_FILE = 'deck_cache.json'
+DECK_CACHE_VERSION = 3
+
+def misspelling(card, infile, magic_cards, correction=None):
+
+    '''Line of misspellings.txt for a card that is not in magic_cards, with the card name it was corrected to or else
+    the closest card names'''
+
+    if correction:
+        return f"{card} in file {infile} (corrected to {correction})\n"
+    suggestions = name_index(magic_cards).suggestions(card)
+    if suggestions:
+        return f"{card} in file {infile} (did you mean: {', '.join(suggestions)}?)\n"
+    return f"{card} in file {infile}\n"
+
+
+def correct_card_names(cards, magic_cards, autocorrect = None, corrections = None):
+
+    '''Replaces the card names that are not in magic_cards by the card name they resolve to (see card_names), if any.
+    The corrected names are added to corrections. autocorrect None leaves the names as they are.'''
+
+    if autocorrect is None or all(not card or card in magic_cards for card in cards):
+        return cards
+
+    index = name_index(magic_cards)
+    corrected = []
+    for card in cards:
+        if card and card not in magic_cards:
+            correction = index.correct(card, autocorrect)
+            if correction:
+                if corrections is not None:
+                    corrections[card] = correction
+                card = correction
+        corrected.append(card)
+    return corrected
+
+
+def make_cube_list(infile, magic_cards, update = False, autocorrect = None):
+    '''Parses the cube list file into a Cube, corrects misspelled card names and writes the corrected, missing and duplicate
+    cards to misspellings.txt'''
     
     with open('program/misspellings.txt', 'w') as misspellings:
         if not update and os.path.exists('magic_cards.json'):
@@ -11,46 +54,89 @@ def make_cube_list(infile, magic_cards, update = False):
             misspellings.write("The following cards in the cube list are not found in Scryfall's database::\n")
         
         with open(infile) as cube_file:
-            cube_list = [line.strip() for line in cube_file]
+            corrections = {}
+            cube = Cube(correct_card_names([card for card in (line.strip() for line in cube_file) if card], magic_cards, autocorrect, corrections),
+                        source=infile)
             
-            for card in cube_list:
+            for card in corrections:
+                misspellings.write(misspelling(card, infile, magic_cards, corrections[card]))
+            for card in cube:
                 if card not in magic_cards:
-                    misspellings.write(f"{card} in file {infile}\n")
+                    misspellings.write(misspelling(card, infile, magic_cards))
+
+        if cube.duplicates:
+            misspellings.write("\nThe following cards are listed more than once in the cube list:\n")
+            for card, count in cube.duplicates.items():
+                misspellings.write(f"{card} ({count} times) in file {infile}\n")
     
-    return cube_list
+    return cube
+
+
+def deck_card_names(path):
+
+    '''The card names of a deck file, in order and without parsing the deck (so also for a deck file that could not be
+    analyzed). Returns an empty list if the file cannot be read.'''
+
+    try:
+        with open(path) as deck_file:
+            # the card lines ('<count> <name>') follow the five header lines, as in make_deck
+            return [' '.join(line.split(' ')[1:]) for line in (line.strip('\n') for line in deck_file.readlines()[5:]) if line]
+    except (OSError, UnicodeDecodeError):
+        return []
+
+
+def used_card_names(directory, cube_file=None):
+
+    '''The names of the cards in the cube list and in every deck file of directory, read without parsing the decks (so
+    without card data), e.g. to look up only the cards that are used.'''
+
+    names = set()
+    if cube_file:
+        with open(cube_file) as file:
+            names.update(line.strip() for line in file)
 
+    for infile in os.listdir(directory):
+        if infile[-4:] == '.txt':
+            names.update(deck_card_names(os.path.join(directory, infile)))
+
+    names.discard('')
+    return names
+
+
+def get_colors(maindeck, magic_cards, splash_threshold = SPLASH_THRESHOLD):
+
+    '''Counts the nonland cards of each color in a main deck. Colors below splash_threshold of the nonland cards are
+    moved to the splash colors.'''
 
-def get_colors(maindeck, magic_cards):
     deck_colors = {'White': 0, 'Blue': 0, 'Black': 0, 'Red': 0, 'Green': 0}
-    splash_colors = {'white': 0, 'Blue': 0, 'Black': 0, 'Red': 0, 'Green': 0}
-    
+    splash_colors = {'White': 0, 'Blue': 0, 'Black': 0, 'Red': 0, 'Green': 0}
+    color_bits = [('White', COLOR_BITS['W']), ('Blue', COLOR_BITS['U']), ('Black', COLOR_BITS['B']), ('Red', COLOR_BITS['R']), ('Green', COLOR_BITS['G'])]
+
+    # count the nonland cards of each color with the precomputed card types and color masks
+    table = card_table(magic_cards)
+    types, colors = table.types, table.colors
+    num_nonlands = 0
     for card in maindeck:
-        if find_card_type(magic_cards[card]['type']) != 'Land':
-            card_color = magic_cards[card]['color']
-            if 'W' in card_color:
-                deck_colors['White'] += 1
-            if 'U' in card_color:
-                deck_colors['Blue'] += 1
-            if 'B' in card_color:
-                deck_colors['Black'] += 1
-            if 'R' in card_color:
-                deck_colors['Red'] += 1
-            if 'G' in card_color:
-                deck_colors['Green'] += 1
-
-    num_nonlands = len([card for card in maindeck if find_card_type(magic_cards[card]['type']) != 'Land'])
-    #temp_color_dict = color_dict.copy()
+        card_id = table.id(card)
+        if types[card_id] != LAND:
+            num_nonlands += 1
+            card_color = colors[card_id]
+            for color, bit in color_bits:
+                if card_color & bit:
+                    deck_colors[color] += 1
+
     for color in deck_colors.keys():
-        if deck_colors[color]/num_nonlands < 0.15 and deck_colors[color] != 0:
+        if deck_colors[color]/num_nonlands < splash_threshold and deck_colors[color] != 0:
             splash_colors[color] = deck_colors[color]
             deck_colors[color] = 0
 
     return deck_colors, splash_colors
 
 
-def make_deck(infile, magic_cards):
+def make_deck(infile, magic_cards, autocorrect = None, corrections = None):
 
-    '''Given a deck text file, analyze its contents. Outputs the main/sideboard rate of cards, the win/loss, deck colors, archetypes'''
+    '''Given a deck text file, analyze its contents. Outputs the main/sideboard rate of cards, the win/loss, deck colors, archetypes.
+    Misspelled card names are corrected (and added to corrections) as in correct_card_names.'''
 
     maindeck, side = [], []
 
@@ -72,6 +158,7 @@ def make_deck(infile, magic_cards):
             else:
                 num, card = card_info.split(' ')[0],' '.join(card_info.split(' ')[1:])
                 cards.extend([card]*int(num))
+        cards = correct_card_names(cards, magic_cards, autocorrect, corrections)
 
         try:
             div = cards.index('')
@@ -87,44 +174,176 @@ def make_deck(infile, magic_cards):
     return maindeck, side, player, deck_color, splash_color, deck_archetypes, win, loss
 
 
-def extract_decklists(directory, magic_cards, cube_list, date_arg, update = False):
+def load_deck_cache(cache_folder, magic_cards, autocorrect = None):
+
+    '''Loads the parsed decks stored in cache_folder. The cache is discarded if it was made with other card data or
+    other card name corrections.'''
+
+    cache_file = os.path.join(cache_folder, DECK_CACHE_FILE)
+    fingerprint = card_data_fingerprint(magic_cards)
+    names = [NAME_INDEX_VERSION, autocorrect]
+
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as file:
+            cache = json.load(file)
+        if cache['version'] == DECK_CACHE_VERSION and cache['cards'] == fingerprint and cache['names'] == names:
+            return cache
+    except (OSError, ValueError, KeyError):
+        pass
+
+    return {'version': DECK_CACHE_VERSION, 'cards': fingerprint, 'names': names, 'decks': {}}
+
+
+def save_deck_cache(cache_folder, cache):
+    os.makedirs(cache_folder, exist_ok=True)
+    cache_file = os.path.join(cache_folder, DECK_CACHE_FILE)
+    with open(cache_file + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(cache, file, ensure_ascii=False)
+    os.replace(cache_file + '.tmp', cache_file)
+
+
+def cached_deck(entry, path):
+
+    '''Returns the cached deck for a deck file if the file is unchanged (same size and mtime, or else same content hash)'''
+
+    if not entry:
+        return None
+
+    stat = os.stat(path)
+    if entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+        return entry['deck']
+
+    with open(path, 'rb') as file:
+        content_hash = hashlib.sha1(file.read()).hexdigest()
+    if entry['hash'] == content_hash:
+        entry['size'], entry['mtime'] = stat.st_size, stat.st_mtime_ns
+        return entry['deck']
+
+    return None
+
+
+def cache_entry(path, deck):
+    stat = os.stat(path)
+    with open(path, 'rb') as file:
+        content_hash = hashlib.sha1(file.read()).hexdigest()
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': content_hash, 'deck': deck}
+
+
+def parse_deck_file(path, magic_cards, autocorrect = None):
+
+    '''Parses a single deck file into a deck record. Returns None if the file could not be analyzed.'''
+
+    corrections = {}
+    try:
+        maindeck, side, player, deck_color, splash_color, archetypes, win, loss = make_deck(path, magic_cards, autocorrect, corrections)
+    except:
+        return None
+
+    return {'main': maindeck, 'side': side, 'player': player, 'color': deck_color, 'splash': splash_color, 'archetypes': archetypes, 'record':[win, loss],
+            'corrections': corrections}
+
+
+_worker_cards = None
+_worker_autocorrect = None
+
+def _init_worker(magic_cards, autocorrect):
+    global _worker_cards, _worker_autocorrect
+    _worker_cards, _worker_autocorrect = magic_cards, autocorrect
+
+def _parse_in_worker(path):
+    return parse_deck_file(path, _worker_cards, _worker_autocorrect)
+
+
+def parse_deck_files(paths, magic_cards, workers = 1, autocorrect = None):
+
+    '''Parses deck files, spread over a pool of worker processes if workers is more than 1 (None uses every CPU).
+    The decks are returned in the same order as the paths.'''
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(paths))
+
+    if workers <= 1:
+        return [parse_deck_file(path, magic_cards, autocorrect) for path in paths]
+
+    # the card data is sent once to each worker instead of with every file. The name index is built (and saved) before
+    # the workers start, so they load it instead of each building it.
+    if autocorrect is not None:
+        name_index(magic_cards)
+    chunksize = max(1, len(paths) // (workers * 8))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(magic_cards, autocorrect)) as executor:
+        return list(executor.map(_parse_in_worker, paths, chunksize=chunksize))
+
+
+def write_deck_misspellings(decks, magic_cards, append = False, update = False):
+
+    '''Writes the corrected and missing card names of the decks to misspellings.txt, once per deck file and name. decks
+    are (file name, corrections, card names) of every deck file. With append they are added after the cube list's (see
+    make_cube_list), otherwise the file is written anew.'''
+
+    with open('program/misspellings.txt', 'a' if append else 'w') as misspellings:
+        source = 'magic_cards.json' if not update and os.path.exists('magic_cards.json') else "Scryfall's database"
+        if append:
+            misspellings.write("\n")
+        misspellings.write(f"The following cards in deck lists are not found in {source}:\n")
+
+        for infile, corrections, cards in decks:
+            for card, correction in corrections.items():
+                misspellings.write(misspelling(card, infile, magic_cards, correction))
+            # a card listed more than once in a deck (e.g. in the main deck and the sideboard) is written once
+            for card in dict.fromkeys(cards):
+                if not magic_cards.get(card):
+                    misspellings.write(misspelling(card, infile, magic_cards))
+
+
+def extract_decklists(directory, magic_cards, cube_list, date_arg, update = False, cache_folder = None, workers = 1,
+                      autocorrect = None):
+
+    '''Parses all the decklists in a directory and creates a dictionary to contain this info. If cache_folder is given,
+    parsed decks are cached there and only new or changed deck files are parsed again. Deck files are parsed in
+    parallel when workers is more than 1. Misspelled card names are corrected if they are at least autocorrect similar
+    to a card name (None leaves them as they are).'''
 
-    '''Parses all the decklists in a directory and creates a dictionary to contain this info.'''
-    if cube_list:
-        misspellings = open('program/misspellings.txt', 'a')
-        if not update and os.path.exists('magic_cards.json'):
-            misspellings.write("\nThe following cards in deck lists are not found in magic_cards.json:\n")
-        else:
-            misspellings.write("\nThe following cards in deck lists are not found in Scryfall's database:\n")
-    else:
-        misspellings = open('program/misspellings.txt', 'w')
-        if not update and os.path.exists('magic_cards.json'):
-            misspellings.write("The following cards in deck lists are not found in magic_cards.json:\n")
-        else:
-            misspellings.write("The following cards in deck lists are not found in Scryfall's database:\n")
-            
     deck_dict = {}
+    parsed = []
+    cache = load_deck_cache(cache_folder, magic_cards, autocorrect) if cache_folder else None
+    cached_decks = {}
 
-    # extract and make the decklist for every deck file in the input directory
-    for i, infile in enumerate(os.listdir(directory)):
+    # deck files in the input directory, keeping the index of the file in the directory listing as the deck id
+    deck_files = [(i, infile, os.path.join(directory, infile)) for i, infile in enumerate(os.listdir(directory)) if infile[-4:] == '.txt'] # added to avoid '.DS_store', etc
 
-        if infile[-4:] != '.txt': continue # added to avoid '.DS_store', etc
+    decks = {path: cached_deck(cache['decks'].get(path), path) if cache else None for _, _, path in deck_files}
 
-        # attempt to analyze decklist. If unable, skip it. Will extract date if it exists.
-        try:
-            maindeck, side, player, deck_color, splash_color, archetypes, win, loss = make_deck(os.path.join(directory,infile), magic_cards)
-            
-            if date_arg:
-                date = infile.split('_')[-1][:-4]
-        except:
+    # parse the new or changed deck files
+    pending = [path for path, deck in decks.items() if deck is None]
+    for path, deck in zip(pending, parse_deck_files(pending, magic_cards, workers, autocorrect)):
+        decks[path] = deck
+        if cache is not None and deck is not None:
+            cache['decks'][path] = cache_entry(path, deck)
+
+    # collect the decks and misspellings in directory order. Will extract date if it exists.
+    for i, infile, path in deck_files:
+
+        deck = decks[path]
+        if deck is None:
+            # the missing card names are still listed, e.g. a misspelled main deck card that is not corrected
             print('File {} could not be analyzed.'.format(infile))
+            parsed.append((infile, {}, deck_card_names(path)))
             continue
 
-        for card in maindeck + side: 
-            if not magic_cards.get(card): 
-                misspellings.write('{} in file {}\n'.format(card, infile))
+        if cache is not None:
+            cached_decks[path] = cache['decks'][path]
+        parsed.append((infile, deck['corrections'], deck['main'] + deck['side']))
+
+        # the deck file name (without extension) is a stable id for the deck, unlike its index in the directory
+        deck_dict[i] = dict(deck, id=os.path.splitext(infile)[0], file=path)
+        if date_arg: deck_dict[i]['date'] = infile.split('_')[-1][:-4]
+
+    write_deck_misspellings(parsed, magic_cards, append=bool(cube_list), update=update)
 
-        deck_dict[i] = {'main': maindeck, 'side': side, 'player': player, 'color': deck_color, 'splash': splash_color, 'archetypes': archetypes, 'record':[win, loss]}
-        if date_arg: deck_dict[i]['date'] = date
+    # only keep the decks that are still in the folder
+    if cache is not None:
+        cache['decks'] = cached_decks
+        save_deck_cache(cache_folder, cache)
 
-    return deck_dict
\ No newline at end of file
+    return deck_dict
@@ -1,24 +1,21 @@
+import importlib.util
 import subprocess
 import sys
 
-required = ["requests", "Pillow", "matplotlib"]
-for package in required:
-    try:
-        __import__(package)
-    except ImportError:
-        subprocess.check_call([sys.executable, "-m", "pip", "install", package])
+# import name and pip package of every dependency. Only checks that they are installed, importing them happens
+# when the analysis first needs them.
+required = {"requests": "requests", "PIL": "Pillow", "matplotlib": "matplotlib", "pandas": "pandas"}
+missing = [package for module, package in required.items() if importlib.util.find_spec(module) is None]
+if missing:
+    subprocess.check_call([sys.executable, "-m", "pip", "install", *missing])
 
 
 import tkinter as tk
 from tkinter import filedialog, messagebox
-from PIL import ImageTk, Image
-from card_utilities import fetch_cards
-from deck_utilities import make_cube_list, extract_decklists
-from analysis_utilities import *
-from visuals import *
-from deck_images import *
 import os
 import json
+import queue
+import threading
 
 SETTINGS_FILE = "program/settings.json"
 
@@ -28,8 +25,10 @@ def load_settings():
             return json.load(f)
     return {}
 
-def save_settings():
-    settings = {
+def current_settings():
+    # the fields of the window, over the saved settings, so the settings that are only set on the command line or in
+    # settings.json (e.g. intervals, dpi) are kept and used by the analysis
+    return dict(load_settings(), **{
         "deck_folder": deck_folder_var.get(),
         "cube_file": cube_file_var.get(),
         "save_folder": save_folder_var.get(),
@@ -37,67 +36,98 @@ def save_settings():
         "images": images_var.get(),
         "date": date_var.get(),
         "filter": filter_var.get(),
-        "window": window_var.get()
-    }
+        "window": window_var.get(),
+        "workers": workers_var.get()
+    })
+
+def save_settings():
+    settings = current_settings()
     with open(SETTINGS_FILE, 'w') as f:
         json.dump(settings, f)
 
 def run_analysis():
-    deck_folder = deck_folder_var.get()
-    cube_file = cube_file_var.get()
-    save_folder = save_folder_var.get()
-    update = update_var.get()
-    images = images_var.get()
-    date_analysis = date_var.get()
-    card_filter = int(filter_var.get())
-    window = int(window_var.get())
-
-    if not deck_folder:
+    settings = current_settings()
+
+    if not settings["deck_folder"]:
         messagebox.showerror("Error", "You must select a deck folder.")
         return
-    if not save_folder:
+    if not settings["save_folder"]:
         messagebox.showerror("Error", "You must select a location to save the results.")
         return
 
-    os.makedirs(save_folder, exist_ok=True)
     save_settings()
 
-    status_var.set("Analysis in progress...")
-    root.update()
-
-    magic_cards = fetch_cards(update)
+    # the pipeline runs on a worker thread and reports back through a queue, so the window stays responsive
+    analysis["events"] = queue.Queue()
+    analysis["cancel"] = threading.Event()
+    analysis["timings"] = []
 
-    if cube_file:
-        cube_list = make_cube_list(cube_file, magic_cards, update)
-    else:
-        cube_list = []
+    worker = threading.Thread(target=analysis_worker, args=(settings, analysis["events"], analysis["cancel"]), daemon=True)
+    worker.start()
 
-    deck_dict = extract_decklists(deck_folder, magic_cards, cube_list, date_analysis, update)
+    start_button.config(state='disabled')
+    cancel_button.config(state='normal')
+    status_var.set("Analysis in progress...")
+    timings_var.set("")
+    root.after(100, poll_analysis)
 
-    archetype_dict = export_archetype_analysis(deck_dict, save_folder)
-    export_card_analysis(deck_dict, cube_list, magic_cards, card_filter, archetype_dict, save_folder)
-    export_color_analysis(deck_dict, magic_cards, save_folder)
-    export_player_analysis(deck_dict, save_folder)
 
-    if date_analysis:
-        archetypes, timecourse = export_timecourse_analysis(deck_dict, window)
-        plot_timecourse(archetypes, timecourse, window, save_folder)
+def analysis_worker(settings, events, cancel):
+    # the pipeline (pandas, matplotlib, ...) is imported on the first run, not when the window opens
+    from pipeline import run_pipeline, AnalysisCancelled
 
-    color_curve = export_color_curve(deck_dict)
-    plot_color_curve(color_curve, save_folder)
-    plot_archetype_analysis(save_folder)
-    plot_card_win_analysis(save_folder)
-    plot_card_main_analysis(save_folder)
-    plot_card_norm_analysis(save_folder)
-    plot_color_analysis(save_folder)
-    plot_player_analysis(save_folder)
+    try:
+        run_pipeline(settings, progress=lambda *event: events.put(event), cancelled=cancel.is_set)
+        events.put(('finished', None, None))
+    except AnalysisCancelled:
+        events.put(('cancelled', None, None))
+    except Exception as e:
+        events.put(('failed', None, e))
+
+
+def poll_analysis():
+    events = analysis["events"]
+    while True:
+        try:
+            event, stage, info = events.get_nowait()
+        except queue.Empty:
+            break
+
+        if event == 'start':
+            status_var.set(f"{stage}...")
+        elif event == 'progress':
+            status_var.set(f"{stage}: {info[0]} of {info[1]}")
+        elif event == 'done':
+            analysis["timings"].append(f"{stage}: {info:.1f} s")
+            timings_var.set("\n".join(analysis["timings"]))
+        else:
+            analysis_finished(event, info)
+            return
+
+    root.after(100, poll_analysis)
+
+
+def analysis_finished(event, error):
+    start_button.config(state='normal')
+    cancel_button.config(state='disabled')
+
+    if event == 'finished':
+        status_var.set("Analysis complete!")
+    elif event == 'cancelled':
+        status_var.set("Analysis cancelled.")
+    else:
+        status_var.set("Analysis failed.")
+        messagebox.showerror("Error", f"The analysis failed: {error}")
 
-    if images:
-        make_deck_images(deck_folder, deck_dict, magic_cards, save_folder)
 
-    status_var.set("Analysis complete!")
+def cancel_analysis():
+    if analysis.get("cancel"):
+        analysis["cancel"].set()
+        status_var.set("Cancelling after the current step...")
 
 def view_analysis_images():
+    from PIL import ImageTk, Image
+
     folder = save_folder_var.get()
     if not folder or not os.path.exists(folder):
         messagebox.showerror("Error", "Please select a valid output folder first.")
@@ -105,7 +135,7 @@ def view_analysis_images():
 
     image_files = [
         f for f in os.listdir(folder)
-        if f.endswith(".png") and "deck_images" not in f.lower()
+        if f.endswith((".png", ".webp")) and "deck_images" not in f.lower()
     ]
     if not image_files:
         messagebox.showinfo("No Images", "No analysis images found in the selected folder.")
@@ -184,63 +214,78 @@ def open_readme_window():
 
 
 def on_close():
+    if analysis.get("cancel"):
+        analysis["cancel"].set()
     save_settings()
     root.destroy()
     root.quit()
 
 # ---------------- GUI Start ----------------
-root = tk.Tk()
-root.title("Magic Cube Analysis")
+if __name__ == '__main__':
+    root = tk.Tk()
+    root.title("Magic Cube Analysis")
+
+    settings = load_settings()
+
+    deck_folder_var = tk.StringVar(value=settings.get("deck_folder", ""))
+    cube_file_var = tk.StringVar(value=settings.get("cube_file", ""))
+    save_folder_var = tk.StringVar(value=settings.get("save_folder", ""))
+    update_var = tk.BooleanVar(value=settings.get("update", False))
+    images_var = tk.BooleanVar(value=settings.get("images", False))
+    date_var = tk.BooleanVar(value=settings.get("date", False))
+    filter_var = tk.StringVar(value=settings.get("filter", "0"))
+    window_var = tk.StringVar(value=settings.get("window", "100"))
+    workers_var = tk.StringVar(value=settings.get("workers", "1"))
+
 
-settings = load_settings()
+    tk.Label(root, text="Select deck folder:").grid(row=0, column=0, sticky='w')
+    tk.Entry(root, textvariable=deck_folder_var, width=30).grid(row=0, column=1)
+    tk.Button(root, text="Browse", command=lambda: deck_folder_var.set(filedialog.askdirectory())).grid(row=0, column=2)
 
-deck_folder_var = tk.StringVar(value=settings.get("deck_folder", ""))
-cube_file_var = tk.StringVar(value=settings.get("cube_file", ""))
-save_folder_var = tk.StringVar(value=settings.get("save_folder", ""))
-update_var = tk.BooleanVar(value=settings.get("update", False))
-images_var = tk.BooleanVar(value=settings.get("images", False))
-date_var = tk.BooleanVar(value=settings.get("date", False))
-filter_var = tk.StringVar(value=settings.get("filter", "0"))
-window_var = tk.StringVar(value=settings.get("window", "100"))
 
+    tk.Label(root, text="Select cube list:").grid(row=1, column=0, sticky='w')
+    tk.Entry(root, textvariable=cube_file_var, width=30).grid(row=1, column=1)
+    tk.Button(root, text="Browse", command=lambda: cube_file_var.set(filedialog.askopenfilename())).grid(row=1, column=2)
 
-tk.Label(root, text="Select deck folder:").grid(row=0, column=0, sticky='w')
-tk.Entry(root, textvariable=deck_folder_var, width=30).grid(row=0, column=1)
-tk.Button(root, text="Browse", command=lambda: deck_folder_var.set(filedialog.askdirectory())).grid(row=0, column=2)
 
+    tk.Label(root, text="Select output folder:").grid(row=2, column=0, sticky='w')
+    tk.Entry(root, textvariable=save_folder_var, width=30).grid(row=2, column=1)
+    tk.Button(root, text="Browse", command=lambda: save_folder_var.set(filedialog.askdirectory())).grid(row=2, column=2)
 
-tk.Label(root, text="Select cube list:").grid(row=1, column=0, sticky='w')
-tk.Entry(root, textvariable=cube_file_var, width=30).grid(row=1, column=1)
-tk.Button(root, text="Browse", command=lambda: cube_file_var.set(filedialog.askopenfilename())).grid(row=1, column=2)
 
+    tk.Checkbutton(root, text="Update card data (Scryfall)", variable=update_var).grid(row=3, column=0, columnspan=2, sticky='w')
+    tk.Checkbutton(root, text="Generate deck images", variable=images_var).grid(row=4, column=0, columnspan=2, sticky='w')
+    tk.Checkbutton(root, text="Time trend analysis", variable=date_var).grid(row=5, column=0, columnspan=2, sticky='w')
 
-tk.Label(root, text="Select output folder:").grid(row=2, column=0, sticky='w')
-tk.Entry(root, textvariable=save_folder_var, width=30).grid(row=2, column=1)
-tk.Button(root, text="Browse", command=lambda: save_folder_var.set(filedialog.askdirectory())).grid(row=2, column=2)
 
+    tk.Label(root, text="Filter value:").grid(row=6, column=0, sticky='w')
+    tk.Entry(root, textvariable=filter_var, width=5).grid(row=6, column=1, sticky='w')
 
-tk.Checkbutton(root, text="Update card data (Scryfall)", variable=update_var).grid(row=3, column=0, columnspan=2, sticky='w')
-tk.Checkbutton(root, text="Generate deck images", variable=images_var).grid(row=4, column=0, columnspan=2, sticky='w')
-tk.Checkbutton(root, text="Time trend analysis", variable=date_var).grid(row=5, column=0, columnspan=2, sticky='w')
+    tk.Label(root, text="Window (time trend):").grid(row=7, column=0, sticky='w')
+    tk.Entry(root, textvariable=window_var, width=5).grid(row=7, column=1, sticky='w')
 
+    tk.Label(root, text="Worker processes:").grid(row=8, column=0, sticky='w')
+    tk.Entry(root, textvariable=workers_var, width=5).grid(row=8, column=1, sticky='w')
 
-tk.Label(root, text="Filter value:").grid(row=6, column=0, sticky='w')
-tk.Entry(root, textvariable=filter_var, width=5).grid(row=6, column=1, sticky='w')
 
-tk.Label(root, text="Window (time trend):").grid(row=7, column=0, sticky='w')
-tk.Entry(root, textvariable=window_var, width=5).grid(row=7, column=1, sticky='w')
+    analysis = {}
 
+    start_button = tk.Button(root, text="Start Analysis", command=run_analysis)
+    start_button.grid(row=10, column=0, columnspan=2, pady=10)
+    cancel_button = tk.Button(root, text="Cancel", command=cancel_analysis, state='disabled')
+    cancel_button.grid(row=10, column=2, pady=10)
 
-tk.Button(root, text="Start Analysis", command=run_analysis).grid(row=9, column=0, columnspan=3, pady=10)
 
+    status_var = tk.StringVar()
+    tk.Label(root, textvariable=status_var, fg='green').grid(row=9, column=0, columnspan=3)
 
-status_var = tk.StringVar()
-tk.Label(root, textvariable=status_var, fg='green').grid(row=8, column=0, columnspan=3)
+    tk.Button(root, text="View Analysis Images", command=view_analysis_images).grid(row=11, column=0, columnspan=3, pady=5)
 
-tk.Button(root, text="View Analysis Images", command=view_analysis_images).grid(row=10, column=0, columnspan=3, pady=5)
+    tk.Button(root, text="View README", command=open_readme_window).grid(row=12, column=0, columnspan=3, pady=5)
 
-tk.Button(root, text="View README", command=open_readme_window).grid(row=11, column=0, columnspan=3, pady=5)
+    timings_var = tk.StringVar()
+    tk.Label(root, textvariable=timings_var, justify='left', font=("Courier", 10)).grid(row=13, column=0, columnspan=3, sticky='w')
 
 
-root.protocol("WM_DELETE_WINDOW", on_close)
-root.mainloop()
+    root.protocol("WM_DELETE_WINDOW", on_close)
+    root.mainloop()
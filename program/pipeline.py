@@ -0,0 +1,327 @@
+from card_utilities import fetch_cards, fetch_used_cards
+from deck_utilities import make_cube_list, extract_decklists, used_card_names
+from cube import Cube
+from contextlib import contextmanager
+from importlib.util import find_spec
+import datetime
+import json
+import os
+import platform
+import time
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+TIMINGS_FILE = 'timings.json'
+PROFILE_FILE = 'profile.pstats'
+
+class AnalysisError(Exception):
+    '''Raised when the analysis cannot be run with the given settings'''
+
+
+class AnalysisCancelled(AnalysisError):
+    '''Raised when the analysis is cancelled between two stages (or two deck images)'''
+
+
+DEFAULT_SETTINGS = {
+    "deck_folder": "",
+    "cube_file": "",
+    "save_folder": "",
+    "update": False,
+    "update_mode": "bulk",
+    "images": False,
+    "date": False,
+    "filter": "0",
+    "window": "100",
+    "workers": "1",
+    "output_format": "csv",
+    "dpi": "300",
+    "image_format": "png",
+    "splash_threshold": "0.15",
+    "autocorrect": "none",
+    "intervals": "none",
+    "resamples": "2000"
+}
+
+
+def max_rss_mb(who='self'):
+
+    '''Peak resident memory in MB of this process (who='self') or of its finished child processes (who='children'), or
+    None where the resource module is not available'''
+
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return round(usage.ru_maxrss / (1e6 if platform.system() == 'Darwin' else 1e3), 1)
+
+
+class StageTimer:
+
+    '''Times the stages of a run. Records the wall and CPU time of each stage, the peak resident memory of the process
+    so far and how much the stage raised it, and optionally the peak Python allocations of each stage (tracemalloc,
+    slows the run down) and a cProfile of the run.'''
+
+    def __init__(self, report=None, check_cancelled=None, profile=False, trace_memory=False):
+        self.report = report
+        self.check_cancelled = check_cancelled
+        self.stages = []
+        self.info = {}
+        self.status = None
+        self.started = datetime.datetime.now().isoformat(timespec='seconds')
+        self._start = time.perf_counter()
+
+        self.trace_memory = trace_memory
+        if trace_memory:
+            import tracemalloc
+            tracemalloc.start()
+
+        self.profiler = None
+        if profile:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    @contextmanager
+    def stage(self, name):
+        if self.check_cancelled:
+            self.check_cancelled()
+        if self.report:
+            self.report('start', name)
+        traced_start = self.restart_peak() if self.trace_memory else 0
+        rss_start = max_rss_mb()
+
+        start, cpu_start = time.perf_counter(), time.process_time()
+        entry = {'name': name}
+        self.stages.append(entry)
+        try:
+            yield
+        except BaseException:
+            entry['failed'] = True
+            raise
+        finally:
+            entry['seconds'] = round(time.perf_counter() - start, 4)
+            entry['cpu_seconds'] = round(time.process_time() - cpu_start, 4)
+            # ru_maxrss is the high-water mark of the whole process, it never goes down
+            entry['process_peak_rss_mb'] = max_rss_mb()
+            if rss_start is not None:
+                entry['peak_rss_increase_mb'] = round(entry['process_peak_rss_mb'] - rss_start, 1)
+            if self.trace_memory:
+                import tracemalloc
+                entry['peak_traced_mb'] = round((tracemalloc.get_traced_memory()[1] - traced_start) / 1e6, 1)
+
+        if self.report:
+            self.report('done', name, entry['seconds'])
+
+    @staticmethod
+    def restart_peak():
+
+        '''Starts a new tracemalloc peak. Returns the traced memory it starts from, as the peak of a stage is counted
+        from there.'''
+
+        import tracemalloc
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+            return tracemalloc.get_traced_memory()[0]
+
+        # Python 3.8 has no reset_peak: trace again from nothing, counting only the allocations of the stage
+        tracemalloc.stop()
+        tracemalloc.start()
+        return 0
+
+    def finish(self, status):
+
+        '''Stops the profiler and memory tracing at the end of the run'''
+
+        self.status = status
+        self.total_seconds = round(time.perf_counter() - self._start, 4)
+        if self.profiler:
+            self.profiler.disable()
+        if self.trace_memory:
+            import tracemalloc
+            tracemalloc.stop()
+
+    def write(self, filename):
+
+        '''Writes the timings to filename as JSON, and the profile (if any) next to it'''
+
+        timings = {
+            'started': self.started,
+            'status': self.status,
+            'total_seconds': self.total_seconds,
+            'max_rss_mb': max_rss_mb(),
+            'max_rss_children_mb': max_rss_mb('children'),
+            'python': platform.python_version(),
+            **self.info,
+            'stages': self.stages
+        }
+        with open(filename, 'w') as file:
+            json.dump(timings, file, indent=4)
+
+        if self.profiler:
+            self.profiler.dump_stats(os.path.join(os.path.dirname(filename), PROFILE_FILE))
+
+def run_pipeline(settings, progress=None, cancelled=None, profile=False, trace_memory=False):
+
+    '''Runs the full analysis for the given settings (the same keys as program/settings.json): loads the card data,
+    parses the decks, exports the analyses, plots them and optionally renders the deck images. Has no GUI dependencies,
+    so it can be driven by the GUI as well as from the command line.
+
+    progress is called with an event ('start', 'done' or 'progress'), the stage name and the stage time in seconds for
+    'done' or (finished, total) for 'progress'. cancelled is polled between stages; the run stops with
+    AnalysisCancelled once it returns true.
+
+    The time, CPU time and peak memory of every stage are written to timings.json in the save folder, also when the run
+    fails or is cancelled. profile adds a cProfile of the whole run (profile.pstats), trace_memory the peak Python
+    allocations of each stage.'''
+
+    settings = dict(DEFAULT_SETTINGS, **settings)
+    deck_folder = settings["deck_folder"]
+    cube_file = settings["cube_file"]
+    save_folder = settings["save_folder"]
+    update = settings["update"]
+    update_mode = settings["update_mode"]
+    images = settings["images"]
+    date_analysis = settings["date"]
+    card_filter = int(settings["filter"])
+    window = int(settings["window"])
+    workers = int(settings["workers"])
+    output_format = settings["output_format"] if settings["output_format"] not in ('', 'none') else None
+    dpi = int(settings["dpi"])
+    image_format = settings["image_format"]
+    splash_threshold = float(settings["splash_threshold"])
+    interval_method = settings["intervals"]
+    resamples = int(settings["resamples"])
+    autocorrect = float(settings["autocorrect"]) if settings["autocorrect"] not in ('', 'none') else None
+
+    if not deck_folder:
+        raise AnalysisError("You must select a deck folder.")
+    if not save_folder:
+        raise AnalysisError("You must select a location to save the results.")
+
+    if output_format not in ('csv', 'parquet', None):
+        raise AnalysisError(f"Unknown output format {output_format}, use csv, parquet or none.")
+    if image_format not in ('png', 'svg', 'webp'):
+        raise AnalysisError(f"Unknown image format {image_format}, use png, svg or webp.")
+    if output_format == 'parquet' and not (find_spec('pyarrow') or find_spec('fastparquet')):
+        raise AnalysisError("Writing parquet files requires pyarrow (pip install pyarrow).")
+    if update_mode not in ('bulk', 'used'):
+        raise AnalysisError(f"Unknown update mode {update_mode}, use bulk or used.")
+    if interval_method not in ('none', 'beta', 'bootstrap'):
+        raise AnalysisError(f"Unknown interval method {interval_method}, use beta, bootstrap or none.")
+
+    os.makedirs(save_folder, exist_ok=True)
+
+    def report(event, name, info=None):
+        if progress:
+            progress(event, name, info)
+
+    def check_cancelled():
+        if cancelled and cancelled():
+            raise AnalysisCancelled("The analysis was cancelled.")
+
+    timer = StageTimer(report, check_cancelled, profile=profile, trace_memory=trace_memory)
+    timer.info['settings'] = settings
+    stage = timer.stage
+    status = 'failed'
+
+    try:
+        with stage('Load card data'):
+            if update and update_mode == 'used':
+                # only look up the cards of the cube list and the decks instead of downloading every card
+                magic_cards = fetch_used_cards(used_card_names(deck_folder, cube_file), workers=max(workers, 4))
+            else:
+                magic_cards = fetch_cards(update)
+
+            if cube_file:
+                cube_list = make_cube_list(cube_file, magic_cards, update, autocorrect)
+            else:
+                cube_list = Cube()
+            # the cube hash identifies the cube the card analysis was filtered with
+            timer.info['cube'] = {'cards': len(cube_list), 'duplicates': len(cube_list.duplicates), 'hash': cube_list.hash}
+
+        with stage('Parse decks'):
+            deck_dict = extract_decklists(deck_folder, magic_cards, cube_list, date_analysis, update, cache_folder=save_folder, workers=workers,
+                                          autocorrect=autocorrect)
+            timer.info['decks'] = len(deck_dict)
+
+        # the analyses run on the columnar deck store, which is also saved with the results
+        with stage('Build deck store'):
+            from deck_store import DeckStore, DECK_STORE_FILE
+            deck_store = DeckStore.from_decks(deck_dict)
+            deck_store.save(os.path.join(save_folder, DECK_STORE_FILE))
+
+        # the analysis, plotting and image modules (numpy, pandas, matplotlib, Pillow) are imported by the first stage using them
+        with stage('Archetype analysis'):
+            from analysis_utilities import (AnalysisResults, export_archetype_analysis, export_card_analysis, export_color_analysis,
+                                            export_player_analysis, export_timecourse_analysis, export_color_curve, WinIntervals)
+            # the result tables are handed to the plots in memory, writing them to files is optional
+            results = AnalysisResults(save_folder, output_format)
+            intervals = WinIntervals(interval_method, resamples, workers=workers) if interval_method != 'none' else None
+            archetype_dict = export_archetype_analysis(deck_store, save_folder, results, intervals)
+        with stage('Card analysis'):
+            export_card_analysis(deck_store, cube_list, magic_cards, card_filter, archetype_dict, save_folder, results, intervals)
+        with stage('Color analysis'):
+            export_color_analysis(deck_store, magic_cards, save_folder, results, splash_threshold)
+        with stage('Player analysis'):
+            export_player_analysis(deck_store, save_folder, results, intervals)
+
+        with stage('Load plotting'):
+            from visuals import (render_plots, plot_timecourse, plot_color_curve, plot_archetype_analysis, plot_card_win_analysis,
+                                 plot_card_main_analysis, plot_card_norm_analysis, plot_color_analysis, plot_player_analysis,
+                                 plot_win_intervals)
+
+        plots = []
+        image_settings = {'dpi': dpi, 'image_format': image_format}
+
+        if date_analysis:
+            with stage('Time trend analysis'):
+                archetypes, timecourse = export_timecourse_analysis(deck_store, window)
+            plots.append(('Plot time trend', plot_timecourse, (archetypes, timecourse, window, save_folder), image_settings))
+
+        with stage('Color curve'):
+            color_curve = export_color_curve(deck_store, magic_cards, splash_threshold)
+
+        plots += [('Plot color curve', plot_color_curve, (color_curve, save_folder), image_settings),
+                  ('Plot archetype analysis', plot_archetype_analysis, (save_folder, results['Archetype_Analysis']), image_settings),
+                  ('Plot card Win %', plot_card_win_analysis, (save_folder, results['Card_Analysis_Win%']), image_settings),
+                  ('Plot card Main %', plot_card_main_analysis, (save_folder, results['Card_Analysis_Main%']), image_settings),
+                  ('Plot card Norm %', plot_card_norm_analysis, (save_folder, results['Card_Analysis_Norm%']), image_settings),
+                  ('Plot color analysis', plot_color_analysis, (save_folder, results['Color_Analysis']), image_settings),
+                  ('Plot player analysis', plot_player_analysis, (save_folder, results['Player_Analysis']), image_settings)]
+        if intervals:
+            plots += [(f'Plot {name.split("_")[0].lower()} intervals', plot_win_intervals, (name, label, save_folder, results[name]), image_settings)
+                      for name, label in (('Card_Analysis_Win%', 'Name'), ('Archetype_Analysis', 'Archetype'), ('Player_Analysis', 'Player'))]
+
+        if workers > 1:
+            def plot_progress(done, total, name):
+                report('progress', 'Plots', (done, total))
+                check_cancelled()
+
+            with stage('Plots'):
+                render_plots(plots, workers, progress=plot_progress)
+        else:
+            for name, function, args, kwargs in plots:
+                with stage(name):
+                    function(*args, **kwargs)
+
+        if images:
+            def deck_progress(done, total, deck_file):
+                report('progress', 'Deck images', (done, total))
+                check_cancelled()
+
+            with stage('Deck images'):
+                from deck_images import make_deck_images
+                make_deck_images(deck_dict, magic_cards, save_folder, render_workers=workers, progress=deck_progress)
+
+        status = 'complete'
+    except AnalysisCancelled:
+        status = 'cancelled'
+        raise
+    finally:
+        timer.finish(status)
+        timer.write(os.path.join(save_folder, TIMINGS_FILE))
+
+    return deck_dict
@@ -1,15 +1,41 @@
 import numpy as np
-import matplotlib.pyplot as plt
 import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pandas as pd
 import os
+from card_utilities import INTERVAL_COLUMNS # shown by plot_win_intervals, not in the tables
 
 matplotlib.rcParams['font.family'] = 'monospace'
 
-def plot_timecourse(archetypes, storage_matrix, window, save_folder='results'):
+IMAGE_FORMATS = ['png', 'svg', 'webp']
+
+def new_figure(figsize=None):
+
+    '''Creates a figure drawn directly by the Agg backend. Unlike pyplot this keeps no global state, so figures can be
+    made from any thread or worker process.'''
+
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig
+
+def save_figure(fig, save_folder, name, dpi=300, image_format='png'):
+    fig.savefig(os.path.join(save_folder, f'{name}.{image_format}'), dpi=dpi, format=image_format)
+
+def load_table(df, save_folder, name):
+
+    '''Returns the result table handed over by the analysis, or reads it back from the csv file if none was given'''
+
+    if df is None:
+        df = pd.read_csv(os.path.join(save_folder, f'csv-files/{name}.csv'))
+    return df
+
+def plot_timecourse(archetypes, storage_matrix, window, save_folder='results', dpi=300, image_format='png'):
 
     '''Given a dataframe containing time course information, plot the win rates'''
-    fig, ax = plt.subplots(1,1, figsize = (10,6))
+    fig = new_figure(figsize = (10,6))
+    ax = fig.subplots()
 
     # only does this for the super archetypes (Aggro, Midrange, Control). Other archetypes are too infrequent to get a good picture.
     colors = {'Aggro':'#ffa600', 'Midrange':'#bc5090', 'Control':'#003f5c'}
@@ -22,48 +48,48 @@ def plot_timecourse(archetypes, storage_matrix, window, save_folder='results'):
     ax.spines['right'].set_visible(False)
 
     ax.legend(fontsize = 14)
-    plt.xlabel('Decks', fontsize = 18)
-    plt.ylabel('Rolling Average', fontsize = 18)
-    plt.xticks(fontsize = 14)
-    plt.yticks(fontsize = 14)
-    plt.title(f'Archetype Winrates, Window={window}', fontsize = 18)
-    plt.tight_layout()
+    ax.set_xlabel('Decks', fontsize = 18)
+    ax.set_ylabel('Rolling Average', fontsize = 18)
+    ax.tick_params(axis='x', labelsize = 14)
+    ax.tick_params(axis='y', labelsize = 14)
+    ax.set_title(f'Archetype Winrates, Window={window}', fontsize = 18)
+    fig.tight_layout()
 
-    fig.savefig(os.path.join(save_folder, 'Archetype_Winrates.png'), dpi = 300)
-    plt.close(fig)
+    save_figure(fig, save_folder, 'Archetype_Winrates', dpi, image_format)
 
-def plot_color_curve(num_colors, save_folder='results'):
+def plot_color_curve(num_colors, save_folder='results', dpi=300, image_format='png'):
 
-    fig, ax = plt.subplots(1,1, figsize = (10,6))
+    fig = new_figure(figsize = (10,6))
+    ax = fig.subplots()
 
     ax.bar(list(num_colors.keys()), list(num_colors.values()))
 
     for i in range(len(list(num_colors.keys()))):
-        plt.text(i, list(num_colors.values())[i] + 0.005, round(list(num_colors.values())[i], 2), ha = 'center')
+        ax.text(i, list(num_colors.values())[i] + 0.005, round(list(num_colors.values())[i], 2), ha = 'center')
 
     ax.spines['top'].set_visible(False)
     ax.spines['right'].set_visible(False)
 
-    plt.ylim(0, round(max(list(num_colors.values())), 1) + 0.05)
-    plt.ylabel('Decks %', fontsize = 18)
-    plt.xticks(fontsize = 10)
-    plt.xticks(rotation=45)
-    plt.yticks(fontsize = 14)
-    plt.title(f'Number of Colors', fontsize = 18)
-    plt.tight_layout()
+    ax.set_ylim(0, round(max(list(num_colors.values())), 1) + 0.05)
+    ax.set_ylabel('Decks %', fontsize = 18)
+    ax.tick_params(axis='x', labelsize = 10)
+    ax.tick_params(axis='x', labelrotation=45)
+    ax.tick_params(axis='y', labelsize = 14)
+    ax.set_title(f'Number of Colors', fontsize = 18)
+    fig.tight_layout()
 
-    fig.savefig(os.path.join(save_folder, 'Color_Curve.png'), dpi = 300)
-    plt.close(fig)
+    save_figure(fig, save_folder, 'Color_Curve', dpi, image_format)
 
 
-def plot_archetype_analysis(save_folder='results'):
-    fig, ax = plt.subplots()
+def plot_archetype_analysis(save_folder='results', df=None, dpi=300, image_format='png'):
+    fig = new_figure()
+    ax = fig.subplots()
 
     ax.axis('off')
     ax.axis('tight')
 
-    df = pd.read_csv(os.path.join(save_folder, 'csv-files/Archetype_Analysis.csv'))
-    df = df.round(3).sort_values(by='Win %', ascending=False)
+    df = load_table(df, save_folder, 'Archetype_Analysis')
+    df = df.round(3).drop(columns=INTERVAL_COLUMNS, errors='ignore').sort_values(by='Win %', ascending=False)
     df_limited = df.head(20)
 
     table = ax.table(cellText=df_limited.values, colLabels=df_limited.columns, loc='center', cellLoc='center')
@@ -71,22 +97,22 @@ def plot_archetype_analysis(save_folder='results'):
     table.auto_set_font_size(False)
     table.set_fontsize(7)
 
-    plt.title('Archetype Analysis')
+    ax.set_title('Archetype Analysis')
 
     fig.tight_layout()
 
-    fig.savefig(os.path.join(save_folder, 'Archetype_Analysis.png'), dpi = 300)
-    plt.close(fig)
+    save_figure(fig, save_folder, 'Archetype_Analysis', dpi, image_format)
 
 
-def plot_card_win_analysis(save_folder='results'):
-    fig, ax = plt.subplots()
+def plot_card_win_analysis(save_folder='results', df=None, dpi=300, image_format='png'):
+    fig = new_figure()
+    ax = fig.subplots()
 
     ax.axis('off')
     ax.axis('tight')
 
-    df = pd.read_csv(os.path.join(save_folder, 'csv-files/Card_Analysis_Win%.csv'))
-    df = df.round(3).drop(columns=['Num', 'Color', 'Mana Value', 'Type'])
+    df = load_table(df, save_folder, 'Card_Analysis_Win%')
+    df = df.round(3).drop(columns=['Num', 'Color', 'Mana Value', 'Type']).drop(columns=INTERVAL_COLUMNS, errors='ignore')
     df.insert(0, 'Rank', range(1, len(df) + 1))
     df_limited = pd.concat([df.head(10), df.tail(10)])
 
@@ -106,21 +132,21 @@ def plot_card_win_analysis(save_folder='results'):
         if key[1] == 1:
             cell.set_width(col_width*0.0125)
 
-    plt.title('Top 10 & Bottom 10 Win %')
+    ax.set_title('Top 10 & Bottom 10 Win %')
 
     fig.tight_layout()
-    fig.savefig(os.path.join(save_folder, 'Card_Analysis_Win%.png'), dpi = 300)
-    plt.close(fig)
+    save_figure(fig, save_folder, 'Card_Analysis_Win%', dpi, image_format)
 
 
-def plot_card_main_analysis(save_folder='results'):
-    fig, ax = plt.subplots()
+def plot_card_main_analysis(save_folder='results', df=None, dpi=300, image_format='png'):
+    fig = new_figure()
+    ax = fig.subplots()
 
     ax.axis('off')
     ax.axis('tight')
 
-    df = pd.read_csv(os.path.join(save_folder, 'csv-files/Card_Analysis_Main%.csv'))
-    df = df.round(3).drop(columns=['Num', 'Color', 'Mana Value', 'Type'])
+    df = load_table(df, save_folder, 'Card_Analysis_Main%')
+    df = df.round(3).drop(columns=['Num', 'Color', 'Mana Value', 'Type']).drop(columns=INTERVAL_COLUMNS, errors='ignore')
     df.insert(0, 'Rank', range(1, len(df) + 1))
     df_limited = pd.concat([df.head(10), df.tail(10)])
 
@@ -141,21 +167,21 @@ def plot_card_main_analysis(save_folder='results'):
         if key[1] == 1:
             cell.set_width(col_width*0.0125)
 
-    plt.title('Top 10 & Bottom 10 Main %')
+    ax.set_title('Top 10 & Bottom 10 Main %')
 
     fig.tight_layout()
-    fig.savefig(os.path.join(save_folder, 'Card_Analysis_Main%.png'), dpi = 300)
-    plt.close(fig)
+    save_figure(fig, save_folder, 'Card_Analysis_Main%', dpi, image_format)
 
 
-def plot_card_norm_analysis(save_folder='results'):
-    fig, ax = plt.subplots()
+def plot_card_norm_analysis(save_folder='results', df=None, dpi=300, image_format='png'):
+    fig = new_figure()
+    ax = fig.subplots()
 
     ax.axis('off')
     ax.axis('tight')
 
-    df = pd.read_csv(os.path.join(save_folder, 'csv-files/Card_Analysis_Norm%.csv'))
-    df = df.round(3).drop(columns=['Num', 'Color', 'Mana Value', 'Type'])
+    df = load_table(df, save_folder, 'Card_Analysis_Norm%')
+    df = df.round(3).drop(columns=['Num', 'Color', 'Mana Value', 'Type']).drop(columns=INTERVAL_COLUMNS, errors='ignore')
     df.insert(0, 'Rank', range(1, len(df) + 1))
     df_limited = pd.concat([df.head(10), df.tail(10)])
 
@@ -175,20 +201,20 @@ def plot_card_norm_analysis(save_folder='results'):
         if key[1] == 1:
             cell.set_width(col_width*0.0125)
 
-    plt.title('Top 10 & Bottom 10 Norm %')
+    ax.set_title('Top 10 & Bottom 10 Norm %')
 
     fig.tight_layout()
-    fig.savefig(os.path.join(save_folder, 'Card_Analysis_Norm%.png'), dpi = 300)
-    plt.close(fig)
+    save_figure(fig, save_folder, 'Card_Analysis_Norm%', dpi, image_format)
 
 
-def plot_color_analysis(save_folder='results'):
-    fig, ax = plt.subplots(figsize=(6, 2.25))
+def plot_color_analysis(save_folder='results', df=None, dpi=300, image_format='png'):
+    fig = new_figure(figsize=(6, 2.25))
+    ax = fig.subplots()
 
     ax.axis('off')
     ax.axis('tight')
 
-    df = pd.read_csv(os.path.join(save_folder, 'csv-files/Color_Analysis.csv'))
+    df = load_table(df, save_folder, 'Color_Analysis')
     df = df.round(3)
 
     table = ax.table(cellText=df.values, colLabels=df.columns, loc='center', cellLoc='center')
@@ -200,21 +226,21 @@ def plot_color_analysis(save_folder='results'):
     table.auto_set_font_size(False)
     table.set_fontsize(7)
 
-    plt.title('Color Analysis')
+    ax.set_title('Color Analysis')
 
     fig.tight_layout()
-    fig.savefig(os.path.join(save_folder, 'Color_Analysis.png'), dpi = 300)
-    plt.close(fig)
+    save_figure(fig, save_folder, 'Color_Analysis', dpi, image_format)
 
 
-def plot_player_analysis(save_folder='results'):
-    fig, ax = plt.subplots(figsize=(6,3.5))
+def plot_player_analysis(save_folder='results', df=None, dpi=300, image_format='png'):
+    fig = new_figure(figsize=(6,3.5))
+    ax = fig.subplots()
 
     ax.axis('off')
     ax.axis('tight')
 
-    df = pd.read_csv(os.path.join(save_folder, 'csv-files/Player_Analysis.csv'))
-    df = df.round(3).sort_values(by='Win %', ascending=False)
+    df = load_table(df, save_folder, 'Player_Analysis')
+    df = df.round(3).drop(columns=INTERVAL_COLUMNS, errors='ignore').sort_values(by='Win %', ascending=False)
     df = df.loc[df['Num'] >= 3]
     df.insert(0, 'Rank', range(1, len(df) + 1))
     df_limited = df.head(10)
@@ -233,8 +259,66 @@ def plot_player_analysis(save_folder='results'):
         if key[1] == 1:
             cell.set_width(col_width*0.0125)
 
-    plt.title('Top 10 Players')
+    ax.set_title('Top 10 Players')
 
     fig.tight_layout()
-    fig.savefig(os.path.join(save_folder, 'Player_Analysis.png'), dpi = 300)
-    plt.close(fig)
\ No newline at end of file
+    save_figure(fig, save_folder, 'Player_Analysis', dpi, image_format)
+
+
+def plot_win_intervals(name, label_column, save_folder='results', df=None, dpi=300, image_format='png'):
+
+    '''Plots the win rates of a table with their intervals as error bars: the top 10 and bottom 10 by Win %, or every
+    row if there are at most 20. Saved as <name>_Intervals.'''
+
+    df = load_table(df, save_folder, name)
+    df = df.dropna(subset=['Win %', 'Win % Low', 'Win % High']).sort_values(by='Win %', ascending=False)
+    if len(df) > 20:
+        df = pd.concat([df.head(10), df.tail(10)])
+
+    fig = new_figure(figsize=(8, 6))
+    ax = fig.subplots()
+
+    positions = np.arange(len(df))[::-1]
+    errors = np.clip([df['Win %'] - df['Win % Low'], df['Win % High'] - df['Win %']], 0, None)
+    ax.errorbar(df['Win %'], positions, xerr=errors, fmt='o', color='#003f5c', ecolor='#bc5090', capsize=3)
+    ax.axvline(0.5, color='grey', linestyle='--', linewidth=1)
+
+    ax.set_yticks(positions)
+    ax.set_yticklabels(df[label_column].astype(str), fontsize=8)
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    ax.set_xlabel('Win %', fontsize=14)
+    ax.set_title(f'{name.replace("_", " ")} intervals', fontsize=14)
+    fig.tight_layout()
+
+    save_figure(fig, save_folder, f'{name}_Intervals', dpi, image_format)
+
+
+def render_plots(plots, workers=1, progress=None):
+
+    '''Renders a list of plots, given as (name, plot function, args, kwargs). With workers more than 1 the plots are
+    rendered by a pool of processes. progress is called with the number of finished plots, the total and the plot name
+    after every plot.'''
+
+    workers = min(workers, len(plots))
+    if workers <= 1:
+        for done, (name, function, args, kwargs) in enumerate(plots, 1):
+            function(*args, **kwargs)
+            if progress:
+                progress(done, len(plots), name)
+        return
+
+    executor = ProcessPoolExecutor(max_workers=workers)
+    futures = {}
+    try:
+        for name, function, args, kwargs in plots:
+            futures[executor.submit(function, *args, **kwargs)] = name
+        for done, future in enumerate(as_completed(futures), 1):
+            future.result()
+            if progress:
+                progress(done, len(plots), futures[future])
+    finally:
+        # cancel the plots that have not started if the run stops early (shutdown(cancel_futures=True) needs Python 3.9)
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
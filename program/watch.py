@@ -0,0 +1,390 @@
+'''Watch mode: keeps the analysis of a deck folder up to date while decks are added, changed or removed. The deck folder
+and the cube list are polled, the running totals of the analyses are updated with the changed decks only, and only the
+tables, plots and deck images whose inputs changed are written again.
+
+    python program/cli.py watch --decks deck_folder --cube cube_list.txt --out results
+'''
+
+import os
+import time
+import numpy as np
+from card_utilities import *
+from deck_utilities import make_cube_list, get_colors, parse_deck_files, deck_card_names, write_deck_misspellings
+from analysis_utilities import (AnalysisResults, COLOR_BUCKETS, WinIntervals, record_frame, card_frame, add_card_tables, color_frame,
+                                color_curve, color_bucket, export_timecourse_analysis)
+from deck_store import COLORS
+from cube import Cube, as_cube
+from pipeline import DEFAULT_SETTINGS, AnalysisError
+
+
+class DeckAggregates:
+
+    '''Running totals of the archetype, player, card and color analyses. A deck adds its contribution when it is added
+    and subtracts it again when it is removed, so an update only costs time for the decks that changed. The card totals
+    are kept for every card; the cube filter is applied when the tables are built. If intervals is given, the record
+    types of every archetype, player and card are kept as well, for the win rate intervals. The contribution of every
+    deck is kept by deck id, so the averages are taken over the decks in the order of a full run, with the same result.'''
+
+    def __init__(self, magic_cards, splash_threshold=SPLASH_THRESHOLD, intervals=None):
+        self.magic_cards = magic_cards
+        self.splash_threshold = splash_threshold
+        self.intervals = intervals
+        self.num_decks = 0
+        self.archetypes = {}     # name -> [decks, wins, losses]
+        self.players = {}
+        self.cards = {}          # name -> [main deck copies, wins, losses, main deck copies in decks with a sideboard, sideboard copies]
+        self.colors = [[0, 0] for _ in COLORS]    # decks playing the color, decks splashing it
+        self.parts = {}          # deck id -> contribution of the deck
+        self.curve = dict.fromkeys(COLOR_BUCKETS, 0)
+        self.record_types = {'archetypes': {}, 'players': {}, 'cards': {}}    # name -> {(wins, losses): decks}
+
+    def contribution(self, deck):
+
+        '''What a deck adds to the totals'''
+
+        wins, losses = map(int, deck['record'])
+        archetypes = deck['archetypes']
+        main, side = {}, {}
+        for zone, cards in ((main, deck['main']), (side, deck['side'])):
+            for card in cards:
+                zone[card] = zone.get(card, 0) + 1
+
+        deck_colors, splash_colors = get_colors(deck['main'], self.magic_cards, self.splash_threshold)
+        table = card_table(self.magic_cards)
+        num_nonlands = sum(1 for card in deck['main'] if table.types[table.id(card)] != LAND)
+        main_colors = [deck_colors[color] for color in COLORS]
+        splashes = [splash_colors[color] for color in COLORS]
+
+        return {'record': (wins, losses),
+                'archetypes': (['Pure ' + archetypes[0]] if len(archetypes) == 1 else []) + archetypes,
+                'label': 'Pure ' + archetypes[0] if len(archetypes) == 1 else archetypes[-1],
+                'players': deck['player'], 'main': main, 'side': side,
+                'colors': [(count != 0, splash != 0, count / num_nonlands) for count, splash in zip(main_colors, splashes)],
+                'bucket': color_bucket(sum(count != 0 for count in main_colors), any(splashes))}
+
+    def add(self, key, deck):
+        self.parts[key] = self.contribution(deck)
+        self.apply(self.parts[key], 1)
+
+    def remove(self, key):
+        self.apply(self.parts.pop(key), -1)
+
+    def apply(self, part, sign):
+        wins, losses = part['record']
+        self.num_decks += sign
+
+        for totals, names, kind in ((self.archetypes, part['archetypes'], 'archetypes'), (self.players, part['players'], 'players')):
+            for name in names:
+                entry = totals.setdefault(name, [0, 0, 0])
+                entry[0] += sign
+                entry[1] += sign * wins
+                entry[2] += sign * losses
+                if entry[0] == 0:
+                    del totals[name]
+                self.add_record_type(kind, name, (wins, losses), sign)
+
+        for card, count in part['main'].items():
+            entry = self.cards.setdefault(card, [0, 0, 0, 0, 0])
+            entry[0] += sign * count
+            entry[1] += sign * count * wins
+            entry[2] += sign * count * losses
+            if part['side']:
+                entry[3] += sign * count
+            self.add_record_type('cards', card, (count * wins, count * losses), sign)
+        for card, count in part['side'].items():
+            self.cards.setdefault(card, [0, 0, 0, 0, 0])[4] += sign * count
+        for card in list(part['main']) + list(part['side']):
+            if card in self.cards and self.cards[card][0] == 0 and self.cards[card][4] == 0:
+                del self.cards[card]
+
+        for totals, (played, splashed, _) in zip(self.colors, part['colors']):
+            totals[0] += sign * played
+            totals[1] += sign * splashed
+
+        self.curve[part['bucket']] += sign
+
+    def add_record_type(self, kind, name, record, sign):
+        if not self.intervals:
+            return
+        types = self.record_types[kind].setdefault(name, {})
+        types[record] = types.get(record, 0) + sign
+        if types[record] == 0:
+            del types[record]
+            if not types:
+                del self.record_types[kind][name]
+
+    def interval(self, kind, names):
+
+        '''The win rate interval of every name, or None if no intervals are computed'''
+
+        if not self.intervals:
+            return None
+        rows = [(group, wins, losses, count) for group, name in enumerate(names)
+                for (wins, losses), count in sorted(self.record_types[kind].get(name, {}).items())]
+        groups, wins, losses, counts = (np.array(column, dtype=np.int64) for column in (zip(*rows) if rows else [[]] * 4))
+        return self.intervals(groups, wins, losses, counts, len(names))
+
+    def archetype_dict(self):
+        return {name: {'num': num, 'win': win, 'loss': loss, 'Win %': win / (win + loss) if win + loss else np.nan}
+                for name, (num, win, loss) in self.archetypes.items()}
+
+    def first_appearance(self, keys):
+
+        '''The archetype rows, players and cards of the decks in order of first appearance, as a DeckStore of the decks
+        numbers them, so the tables have the rows (and ties) in the same order as the tables of a full run'''
+
+        archetypes, players, cards = {}, {}, {}
+        for key in keys:
+            part = self.parts[key]
+            archetypes.update(dict.fromkeys(part['archetypes']))
+            players.update(dict.fromkeys(part['players']))
+            cards.update(dict.fromkeys(part['main']))
+            cards.update(dict.fromkeys(part['side']))
+        return list(archetypes), list(players), list(cards)
+
+    def tables(self, cube_list, card_filter, keys):
+
+        '''Builds the analysis tables (as added by the export functions) and the color curve from the totals. keys are
+        the ids of the decks in the order of a full run, which gives the order of the rows and of the averages.'''
+
+        keys = list(keys)
+        archetype_order, player_order, card_order = self.first_appearance(keys)
+        results = AnalysisResults(output_format=None)
+        for name, totals, order, label_column, kind in (('Archetype_Analysis', self.archetypes, archetype_order, 'Archetype', 'archetypes'),
+                                                        ('Player_Analysis', self.players, player_order, 'Player', 'players')):
+            names = [label for label in order if label in totals]
+            num, win, loss = zip(*[totals[name] for name in names]) if names else ([], [], [])
+            results[name] = record_frame(names, num, win, loss, label_column, self.interval(kind, names))
+
+        # cards that exist in Scryfall and in the cube, as in card_occurrences
+        cube = as_cube(cube_list)
+        card_names = [card for card in card_order if card in self.cards and self.magic_cards.get(card) and cube.allows(card)]
+        num, win, loss, main_with_side, in_side = (np.array(column, dtype=np.int64).reshape(-1) for column in
+                                                   (zip(*[self.cards[card] for card in card_names]) if card_names else [[]] * 5))
+
+        # the archetype win rate of every main deck copy of a card, in deck order, averaged as card_statistics does
+        archetype_winrates = {name: entry['Win %'] for name, entry in self.archetype_dict().items()}
+        copies = {card: [] for card in card_names}
+        for key in keys:
+            part = self.parts[key]
+            for card, count in part['main'].items():
+                if card in copies:
+                    copies[card].extend([archetype_winrates[part['label']]] * count)
+        archetype_average = np.array([np.array(copies[card]).mean() if copies[card] else np.nan for card in card_names], dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            main_rate = np.where(main_with_side + in_side > 0, main_with_side / (main_with_side + in_side), np.nan)
+            win_rate = win / (win + loss)
+            norm_rate = win_rate / archetype_average
+        sideboarded = main_rate == 0
+        win_rate[sideboarded], norm_rate[sideboarded] = np.nan, np.nan
+
+        statistics = {'Win': win, 'Loss': loss, 'Num': num, 'Main %': main_rate, 'Win %': win_rate, 'Norm %': norm_rate}
+        if self.intervals:
+            low, high = self.interval('cards', card_names)
+            low[sideboarded], high[sideboarded] = np.nan, np.nan
+            statistics.update({'Win % Low': low, 'Win % High': high, 'Norm % Low': low / archetype_average, 'Norm % High': high / archetype_average})
+        add_card_tables(card_frame(card_names, statistics, self.magic_cards), card_filter, results)
+
+        # the nonland card share of every deck playing a color, in deck order, averaged as export_color_analysis does
+        shares = [[] for _ in COLORS]
+        for key in keys:
+            for color_shares, (played, _, share) in zip(shares, self.parts[key]['colors']):
+                if played:
+                    color_shares.append(share)
+        card_spreads = [np.average(color_shares) if color_shares else np.nan for color_shares in shares]
+        results['Color_Analysis'] = color_frame(self.num_decks, [played for played, _ in self.colors], [splashed for _, splashed in self.colors], card_spreads)
+
+        return results, color_curve(self.curve, self.num_decks)
+
+
+class Watcher:
+
+    '''Polls a deck folder (and the cube list) and keeps the results in the save folder up to date'''
+
+    def __init__(self, settings, progress=print):
+        settings = dict(DEFAULT_SETTINGS, **settings)
+        self.deck_folder = settings["deck_folder"]
+        self.cube_file = settings["cube_file"]
+        self.save_folder = settings["save_folder"]
+        self.images = settings["images"]
+        self.date_analysis = settings["date"]
+        self.card_filter = int(settings["filter"])
+        self.window = int(settings["window"])
+        self.workers = int(settings["workers"])
+        self.autocorrect = float(settings["autocorrect"]) if settings["autocorrect"] not in ('', 'none') else None
+        self.output_format = settings["output_format"] if settings["output_format"] not in ('', 'none') else None
+        self.image_settings = {'dpi': int(settings["dpi"]), 'image_format': settings["image_format"]}
+        self.progress = progress
+
+        if not self.deck_folder:
+            raise AnalysisError("You must select a deck folder.")
+        if not self.save_folder:
+            raise AnalysisError("You must select a location to save the results.")
+        os.makedirs(self.save_folder, exist_ok=True)
+
+        self.magic_cards = fetch_cards(False)
+        intervals = WinIntervals(settings["intervals"], int(settings["resamples"]), workers=self.workers) if settings["intervals"] != 'none' else None
+        self.aggregates = DeckAggregates(self.magic_cards, float(settings["splash_threshold"]), intervals)
+        self.files = {}          # deck file name -> (size, mtime) when it was parsed
+        self.deck_ids = {}       # deck file name -> deck id
+        self.deck_dict = {}      # deck id -> deck record, as returned by extract_decklists
+        self.unparsed = {}       # deck file name -> card names, for the deck files that could not be analyzed
+        self.cube_state = None
+        self.cube_list = Cube()
+        self.listing = []        # deck file names in directory order, the order a full run reads them in
+        self.tables = {}         # the tables and color curve as last written and plotted
+        self.next_id = 0
+
+    def scan(self):
+
+        '''Returns the deck files that were added or changed, and the ones that were removed, since the last scan'''
+
+        current = {}
+        with os.scandir(self.deck_folder) as entries:
+            for entry in entries:
+                if entry.name.endswith('.txt') and entry.is_file():
+                    stat = entry.stat()
+                    current[entry.name] = (stat.st_size, stat.st_mtime_ns)
+
+        changed = sorted(name for name, state in current.items() if self.files.get(name) != state)
+        removed = sorted(name for name in self.files if name not in current)
+        return changed, removed, current
+
+    def update(self):
+
+        '''Applies the changes since the last update. Returns true if anything changed.'''
+
+        changed, removed, current = self.scan()
+
+        # the cube list is read again when it was modified, but only counts as changed if its cards changed (by hash)
+        cube_state = os.stat(self.cube_file).st_mtime_ns if self.cube_file else None
+        cube_read = cube_state != self.cube_state
+        cube_changed = False
+        if cube_read:
+            self.cube_state = cube_state
+            cube = make_cube_list(self.cube_file, self.magic_cards, autocorrect=self.autocorrect) if self.cube_file else Cube()
+            cube_changed, self.cube_list = cube.hash != self.cube_list.hash, cube
+
+        if not (changed or removed or cube_changed):
+            if cube_read:
+                self.write_misspellings(cube_written=True)
+            return False
+
+        # subtract the old version of every changed or removed deck, then add the new versions
+        for name in changed + removed:
+            deck_id = self.deck_ids.get(name)
+            if deck_id in self.deck_dict:
+                deck = self.deck_dict.pop(deck_id)
+                self.aggregates.remove(deck_id)
+                if name in removed:
+                    self.remove_deck_image(deck)
+        for name in changed + removed:
+            self.unparsed.pop(name, None)
+        for name in removed:
+            del self.files[name], self.deck_ids[name]
+        self.listing = list(current)
+
+        paths = [os.path.join(self.deck_folder, name) for name in changed]
+        for name, path, deck in zip(changed, paths, parse_deck_files(paths, self.magic_cards, self.workers, self.autocorrect)):
+            self.files[name] = current[name]
+            if name not in self.deck_ids:
+                self.deck_ids[name], self.next_id = self.next_id, self.next_id + 1
+            if deck is None:
+                self.progress(f'File {name} could not be analyzed.')
+                self.unparsed[name] = deck_card_names(path)
+                continue
+            deck = dict(deck, id=os.path.splitext(name)[0], file=path)
+            if self.date_analysis:
+                deck['date'] = name.split('_')[-1][:-4]
+            self.deck_dict[self.deck_ids[name]] = deck
+            self.aggregates.add(self.deck_ids[name], deck)
+
+        self.write_misspellings(cube_written=cube_read)
+        self.progress(f'{len(changed)} deck files added or changed, {len(removed)} removed{", cube list changed" if cube_changed else ""}; '
+                      f'{len(self.deck_dict)} decks')
+        self.export(decks_changed=bool(changed or removed))
+        return True
+
+    def write_misspellings(self, cube_written=False):
+
+        '''Writes misspellings.txt as a full run does: the misspellings of the cube list, then those of the decks in
+        directory order. cube_written is true if make_cube_list has just written the cube list's.'''
+
+        if self.cube_file and not cube_written:
+            make_cube_list(self.cube_file, self.magic_cards, autocorrect=self.autocorrect)
+        decks = []
+        for name in self.listing:
+            if self.deck_ids.get(name) in self.deck_dict:
+                deck = self.deck_dict[self.deck_ids[name]]
+                decks.append((name, deck['corrections'], deck['main'] + deck['side']))
+            elif name in self.unparsed:
+                decks.append((name, {}, self.unparsed[name]))
+        write_deck_misspellings(decks, self.magic_cards, append=bool(self.cube_file))
+
+    def export(self, decks_changed=True):
+
+        '''Writes the tables and plots whose contents changed, and the deck images of new or changed decks'''
+
+        from visuals import (render_plots, plot_timecourse, plot_color_curve, plot_archetype_analysis, plot_card_win_analysis,
+                             plot_card_main_analysis, plot_card_norm_analysis, plot_color_analysis, plot_player_analysis,
+                             plot_win_intervals)
+
+        if not self.deck_dict:
+            return
+
+        # the decks in directory order, as extract_decklists returns them
+        deck_dict = {self.deck_ids[name]: self.deck_dict[self.deck_ids[name]] for name in self.listing if self.deck_ids.get(name) in self.deck_dict}
+        tables, curve = self.aggregates.tables(self.cube_list, self.card_filter, deck_dict)
+        sink = AnalysisResults(self.save_folder, self.output_format)
+        changed = set()
+        for name, df in tables.items():
+            if name not in self.tables or not df.equals(self.tables[name]):
+                sink.add(name, df)
+                changed.add(name)
+        if curve != self.tables.get('Color_Curve'):
+            changed.add('Color_Curve')
+        self.tables = dict(tables, Color_Curve=curve)
+
+        table_plots = {'Archetype_Analysis': plot_archetype_analysis, 'Card_Analysis_Win%': plot_card_win_analysis,
+                       'Card_Analysis_Main%': plot_card_main_analysis, 'Card_Analysis_Norm%': plot_card_norm_analysis,
+                       'Color_Analysis': plot_color_analysis, 'Player_Analysis': plot_player_analysis}
+        plots = [(name, function, (self.save_folder, tables[name]), self.image_settings) for name, function in table_plots.items() if name in changed]
+        if self.aggregates.intervals:
+            plots += [(f'{name}_Intervals', plot_win_intervals, (name, label, self.save_folder, tables[name]), self.image_settings)
+                      for name, label in (('Card_Analysis_Win%', 'Name'), ('Archetype_Analysis', 'Archetype'), ('Player_Analysis', 'Player')) if name in changed]
+        if 'Color_Curve' in changed:
+            plots.append(('Color_Curve', plot_color_curve, (curve, self.save_folder), self.image_settings))
+        if self.date_analysis and decks_changed:
+            archetypes, timecourse = export_timecourse_analysis(deck_dict, self.window)
+            plots.append(('Archetype_Winrates', plot_timecourse, (archetypes, timecourse, self.window, self.save_folder), self.image_settings))
+
+        render_plots(plots, self.workers)
+        self.progress(f'Updated {", ".join(name for name, _, _, _ in plots) or "no plots"}')
+
+        if self.images and decks_changed:
+            from deck_images import make_deck_images
+            make_deck_images(deck_dict, self.magic_cards, self.save_folder, render_workers=self.workers, progress=None)
+
+    def remove_deck_image(self, deck):
+        image = os.path.join(self.save_folder, 'deck_images', deck['id'] + '.png')
+        if os.path.exists(image):
+            os.remove(image)
+
+
+def watch(settings, interval=5.0, cycles=None, progress=print, stop=None):
+
+    '''Runs the analysis, then polls for changes every interval seconds and applies them. Stops after the given number
+    of polls (cycles), when stop returns true, or on Ctrl+C.'''
+
+    watcher = Watcher(settings, progress)
+    polls = 0
+    try:
+        while True:
+            watcher.update()
+            polls += 1
+            if (cycles and polls >= cycles) or (stop and stop()):
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    return watcher